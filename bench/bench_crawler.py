@@ -0,0 +1,173 @@
+# bench/bench_crawler.py
+#
+# Replays the crawler pipeline against local fixtures so runs are comparable:
+#
+#    python bench/bench_crawler.py --categories 10 --products 50 --http
+#
+# wiraa.ir, the Torob search API and Torob detail pages are served by
+# ReplayServer; Supabase is replaced by an in-memory stub. Reports pages/sec,
+# matches/sec, p50/p99 latency per stage and peak RSS, and appends one JSON
+# line per run to --out so results can be diffed across commits.
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def configure_env(args):
+    # Must happen before `crawler` is imported: its settings are read at import.
+    os.environ["WIRAAI_DATA_DIR"] = args.data_dir or tempfile.mkdtemp(prefix="wiraai-bench-")
+    os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+    os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "bench")
+    os.environ.setdefault("CRAWL_INCREMENTAL", "0")
+    os.environ.setdefault("CRAWL_RESUME", "0")
+    os.environ.setdefault("TOROB_RATE", "1000")
+    os.environ.setdefault("CRAWL_DB_FLUSH_INTERVAL", "0.5")
+
+
+def timed(fn, samples: list[float]):
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*a, **kw):
+            start = time.perf_counter()
+            try:
+                return await fn(*a, **kw)
+            finally:
+                samples.append(time.perf_counter() - start)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            start = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            finally:
+                samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    t = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "p50_ms": round(float(np.percentile(t, 50)), 2),
+        "p99_ms": round(float(np.percentile(t, 99)), 2),
+        "max_ms": round(float(t.max()), 2),
+    }
+
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is in KiB on Linux; children covers browser processes.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {"self": round(own, 1), "children": round(children, 1)}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def run(args) -> dict:
+    import crawler
+    import torob_client
+    import torob_details
+    from crawl4ai import AsyncWebCrawler
+    from crawl4ai.async_crawler_strategy import AsyncHTTPCrawlerStrategy
+
+    from replay_server import ReplayServer
+    from supabase_stub import InMemorySupabase
+
+    stages = {"parse": [], "torob": [], "write": []}
+    db = InMemorySupabase()
+
+    async with ReplayServer(args.categories, args.products, latency=args.latency / 1000) as server:
+        crawler.BASE_URL = server.url
+        crawler.supabase = db
+        torob_client.TOROB_SEARCH_URL = server.url + "/v4/base-product/search/"
+        torob_details.TOROB_BASE_URL = server.url
+        if args.http:
+            crawler.AsyncWebCrawler = functools.partial(
+                AsyncWebCrawler, crawler_strategy=AsyncHTTPCrawlerStrategy()
+            )
+        if not args.semantic:
+            crawler._EMBEDDINGS._unavailable = True
+
+        crawler.parse_product = timed(crawler.parse_product, stages["parse"])
+        crawler.lookup_torob = timed(crawler.lookup_torob, stages["torob"])
+        crawler.write_job = timed(crawler.write_job, stages["write"])
+
+        log = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+            await crawler.main()
+        elapsed = time.perf_counter() - start
+
+    pages = server.requests.get("/product/{slug}", 0) + server.requests.get("/category/{category}", 0)
+    db_calls = [c for c in db.calls if c[1] in ("upsert", "insert")]
+    rss = peak_rss_mb()   # before git_revision() forks a child
+    return {
+        "rev": git_revision(),
+        "mode": "http" if args.http else "browser",
+        "semantic": args.semantic,
+        "categories": args.categories,
+        "products": server.product_count,
+        "latency_ms": args.latency,
+        "elapsed_s": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 1),
+        "matches_per_s": round(crawler.RANKER.stats["products"] / elapsed, 1),
+        "stages": {**{name: percentiles(samples) for name, samples in stages.items()},
+                   "score": percentiles(crawler.RANKER.timings)},
+        "ranking": crawler.RANKER.summary(),
+        "server": {route: percentiles(t) for route, t in server.timings.items()},
+        "db": {
+            "calls": len(db_calls),
+            "rows": sum(c[2] for c in db_calls),
+            "products": len(db.rows("products")),
+            "competitor_prices": len(db.rows("competitor_prices")),
+            "review_queue": len(db.rows("review_queue")),
+        },
+        "peak_rss_mb": rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay benchmark for crawler.py")
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--products", type=int, default=50, help="products per category")
+    parser.add_argument("--latency", type=float, default=0, help="added per response, in ms")
+    parser.add_argument("--http", action="store_true", help="fetch with the HTTP strategy instead of a browser")
+    parser.add_argument("--semantic", action="store_true", help="load the embedding model for scoring")
+    parser.add_argument("--data-dir", help="state dir (default: a fresh temp dir, i.e. cold caches)")
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results.jsonl"))
+    parser.add_argument("--verbose", action="store_true", help="show the crawler's own output")
+    args = parser.parse_args()
+
+    configure_env(args)
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
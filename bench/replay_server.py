@@ -0,0 +1,157 @@
+# bench/replay_server.py
+
+import asyncio
+import copy
+import json
+import os
+import time
+import zlib
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def _fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+class ReplayServer:
+    """
+    Local stand-in for wiraa.ir, the Torob search API and Torob detail pages.
+
+    Pages are rendered from the recorded fixtures in bench/fixtures, scaled to
+    `categories` × `products_per_category` products. Every response can be
+    delayed by `latency` seconds to mimic network round trips, and each route
+    counts its requests and handler latencies.
+
+        async with ReplayServer(categories=10, products_per_category=50) as server:
+            server.url   # http://127.0.0.1:<port>
+    """
+
+    def __init__(self, categories: int = 10, products_per_category: int = 50,
+                 latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.categories = categories
+        self.products_per_category = products_per_category
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.requests: dict[str, int] = {}
+        self.timings: dict[str, list[float]] = {}
+
+        catalog = json.loads(_fixture("catalog.json"))
+        self._names = catalog["names"]
+        self._shops = catalog["shops"]
+        self._home = _fixture("wiraa_home.html")
+        self._category = _fixture("wiraa_category.html")
+        self._product = _fixture("wiraa_product.html")
+        self._torob_product = _fixture("torob_product.html")
+        self._torob_search = json.loads(_fixture("torob_search.json"))
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def product_count(self) -> int:
+        return self.categories * self.products_per_category
+
+    def product_name(self, index: int) -> str:
+        base = self._names[index % len(self._names)]
+        return f"{base} مدل {index}"
+
+    async def __aenter__(self):
+        app = web.Application(middlewares=[self._track])
+        app.router.add_get("/", self._home_page)
+        app.router.add_get("/category/{category}", self._category_page)
+        app.router.add_get("/product/{slug}", self._product_page)
+        app.router.add_get("/v4/base-product/search/", self._search)
+        app.router.add_get("/p/{key}/", self._torob_detail)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._runner.cleanup()
+
+    @web.middleware
+    async def _track(self, request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else "?"
+        start = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            return await handler(request)
+        finally:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.timings.setdefault(route, []).append(time.perf_counter() - start)
+
+    # ── wiraa.ir ─────────────────────────────────────────────────────────────
+    async def _home_page(self, request):
+        links = "\n      ".join(
+            f'<li><a href="/category/c{c}">دسته {c}</a></li>' for c in range(self.categories)
+        )
+        return web.Response(text=self._home.replace("{categories}", links), content_type="text/html")
+
+    async def _category_page(self, request):
+        category = request.match_info["category"]
+        try:
+            c = int(category.lstrip("c"))
+        except ValueError:
+            raise web.HTTPNotFound()
+        start = c * self.products_per_category
+        cards = "\n    ".join(
+            f'<div class="product-card"><a href="/product/p{i}" class="product-card__link">'
+            f"{self.product_name(i)}</a></div>"
+            for i in range(start, start + self.products_per_category)
+        )
+        html = (self._category.replace("{title}", f"دسته {c}")
+                .replace("{products}", cards)
+                .replace("{pagination}", ""))
+        return web.Response(text=html, content_type="text/html")
+
+    async def _product_page(self, request):
+        slug = request.match_info["slug"]
+        try:
+            i = int(slug.lstrip("p"))
+        except ValueError:
+            raise web.HTTPNotFound()
+        price = 1_000_000 + (i * 7919) % 50_000_000
+        html = (self._product.replace("{name}", self.product_name(i))
+                .replace("{price}", f"{price:,}")
+                .replace("{category}", f"c{i // self.products_per_category}")
+                .replace("{related}", f"p{(i + 1) % self.product_count}"))
+        etag = f'"{zlib.crc32(html.encode()):08x}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=html, content_type="text/html", headers={"ETag": etag})
+
+    # ── Torob ────────────────────────────────────────────────────────────────
+    async def _search(self, request):
+        query = request.query.get("q", "")
+        page = int(request.query.get("page", "0"))
+        body = copy.deepcopy(self._torob_search)
+        # Recorded results, with a few near-duplicates of the query mixed in so
+        # scoring has realistic winners on some pages and none on others.
+        seed = zlib.crc32(f"{query}|{page}".encode())
+        for j, item in enumerate(body["results"]):
+            item["random_key"] = f"{item['random_key']}-{page}"
+            item["web_client_absolute_url"] = f"/p/{item['random_key']}/"
+            if (seed >> j) & 7 == 0:
+                item["name1"] = query if j % 2 else f"{query} اصل"
+        return web.json_response(body)
+
+    async def _torob_detail(self, request):
+        key = request.match_info["key"]
+        seed = zlib.crc32(key.encode())
+        shops = "\n  ".join(
+            f'<a class="shop-name" href="/shop/{k}">{self._shops[(seed + k) % len(self._shops)]}, تهران</a>'
+            for k in range(5)
+        )
+        html = self._torob_product.replace("{name}", key).replace("{shops}", shops)
+        return web.Response(text=html, content_type="text/html")
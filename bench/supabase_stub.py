@@ -0,0 +1,129 @@
+# bench/supabase_stub.py
+
+import time
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, db: "InMemorySupabase", table: str):
+        self.db = db
+        self.table = table
+        self._op = None
+        self._rows: list[dict] = []
+        self._on_conflict: str | None = None
+        self._filters: list = []
+        self._order: str | None = None
+        self._limit: int | None = None
+
+    # writes
+    def upsert(self, rows, on_conflict: str | None = None, ignore_duplicates: bool = False, **_):
+        self._op, self._rows, self._on_conflict = "upsert", _as_list(rows), on_conflict
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def insert(self, rows, **_):
+        self._op, self._rows = "insert", _as_list(rows)
+        return self
+
+    def update(self, values: dict):
+        self._op, self._rows = "update", [values]
+        return self
+
+    # reads
+    def select(self, *_columns, **_):
+        self._op = "select"
+        return self
+
+    def eq(self, col, value):
+        self._filters.append(lambda r: r.get(col) == value)
+        return self
+
+    def gt(self, col, value):
+        self._filters.append(lambda r: r.get(col) is not None and r[col] > value)
+        return self
+
+    def gte(self, col, value):
+        self._filters.append(lambda r: r.get(col) is not None and r[col] >= value)
+        return self
+
+    def in_(self, col, values):
+        values = set(values)
+        self._filters.append(lambda r: r.get(col) in values)
+        return self
+
+    def order(self, col, **_):
+        self._order = col
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def single(self):
+        self._limit = 1
+        return self
+
+    def execute(self):
+        start = time.perf_counter()
+        try:
+            return _Response(getattr(self, f"_{self._op}")())
+        finally:
+            self.db.calls.append((self.table, self._op, len(self._rows), time.perf_counter() - start))
+
+    def _upsert(self):
+        table = self.db.tables.setdefault(self.table, {})
+        cols = [c.strip() for c in (self._on_conflict or "id").split(",")]
+        for row in self._rows:
+            key = tuple(row.get(c) for c in cols)
+            if key in table and self._ignore_duplicates:
+                continue
+            table[key] = {**table.get(key, {}), **row}
+        return self._rows
+
+    def _insert(self):
+        table = self.db.tables.setdefault(self.table, {})
+        for row in self._rows:
+            table[("_seq", len(table))] = dict(row)
+        return self._rows
+
+    def _matching(self):
+        return [r for r in self.db.tables.get(self.table, {}).values() if all(f(r) for f in self._filters)]
+
+    def _update(self):
+        rows = self._matching()
+        for r in rows:
+            r.update(self._rows[0])
+        return rows
+
+    def _select(self):
+        rows = self._matching()
+        if self._order:
+            rows.sort(key=lambda r: r.get(self._order))
+        return rows[:self._limit] if self._limit is not None else rows
+
+
+def _as_list(rows):
+    return rows if isinstance(rows, list) else [rows]
+
+
+class InMemorySupabase:
+    """
+    Just enough of the supabase-py query builder for the crawler and matcher
+    (table → upsert/insert/update/select with eq/gt/gte/in_/order/limit), kept
+    in dicts. Every executed call is logged in `calls` as
+    (table, op, rows, seconds) so the benchmark can report write volume.
+    """
+
+    def __init__(self):
+        self.tables: dict[str, dict] = {}
+        self.calls: list[tuple] = []
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def rows(self, name: str) -> list[dict]:
+        return list(self.tables.get(name, {}).values())
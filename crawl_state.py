@@ -0,0 +1,330 @@
+# crawl_state.py
+
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+import aiosqlite
+
+from storage import data_path
+
+
+def content_hash(product: dict) -> str:
+    """Hash of the fields we actually store, so cosmetic page changes don't count."""
+    payload = json.dumps([product.get("name"), product.get("price")], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class CrawlStateDB:
+    """
+    Local SQLite record of what previous crawls saw, per URL.
+
+    Follows crawl4ai's AsyncDatabaseManager: lazy one-time schema setup behind
+    an init lock, a semaphore-bounded pool of WAL-mode aiosqlite connections,
+    and `execute_with_retry` for every operation.
+    """
+
+    def __init__(self, path: str | None = None, pool_size: int = 5, max_retries: int = 3):
+        self.db_path = path or data_path("crawl_state.db")
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.connection_pool: list[aiosqlite.Connection] = []
+        self.pool_lock = asyncio.Lock()
+        self.init_lock = asyncio.Lock()
+        self.connection_semaphore = asyncio.Semaphore(pool_size)
+        self._initialized = False
+
+    async def __aenter__(self):
+        await self.initialize()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.cleanup()
+
+    async def initialize(self):
+        async with self.init_lock:
+            if self._initialized:
+                return
+            async with aiosqlite.connect(self.db_path, timeout=30.0) as db:
+                await db.execute("PRAGMA journal_mode = WAL")
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS page_state (
+                        url TEXT PRIMARY KEY,
+                        etag TEXT,
+                        last_modified TEXT,
+                        content_hash TEXT,
+                        checked_at REAL,
+                        processed_at REAL
+                    )
+                    """
+                )
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS crawl_runs (
+                        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        started_at REAL,
+                        finished_at REAL
+                    )
+                    """
+                )
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS frontier (
+                        run_id INTEGER,
+                        url TEXT,
+                        kind TEXT,
+                        status TEXT DEFAULT 'discovered',
+                        torob_status TEXT DEFAULT 'pending',
+                        payload TEXT,
+                        updated_at REAL,
+                        PRIMARY KEY (run_id, url)
+                    )
+                    """
+                )
+                await db.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_frontier_status ON frontier (run_id, kind, status)"
+                )
+                await db.commit()
+            self._initialized = True
+
+    async def cleanup(self):
+        async with self.pool_lock:
+            for conn in self.connection_pool:
+                await conn.close()
+            self.connection_pool.clear()
+
+    @asynccontextmanager
+    async def get_connection(self):
+        if not self._initialized:
+            await self.initialize()
+
+        await self.connection_semaphore.acquire()
+        try:
+            async with self.pool_lock:
+                conn = self.connection_pool.pop() if self.connection_pool else None
+            if conn is None:
+                conn = await aiosqlite.connect(self.db_path, timeout=30.0)
+                await conn.execute("PRAGMA journal_mode = WAL")
+                await conn.execute("PRAGMA busy_timeout = 5000")
+            try:
+                yield conn
+            except Exception:
+                await conn.close()
+                raise
+            else:
+                async with self.pool_lock:
+                    self.connection_pool.append(conn)
+        finally:
+            self.connection_semaphore.release()
+
+    async def execute_with_retry(self, operation, *args):
+        for attempt in range(self.max_retries):
+            try:
+                async with self.get_connection() as db:
+                    result = await operation(db, *args)
+                    await db.commit()
+                    return result
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    print(f"[ERROR] crawl state operation failed after {self.max_retries} attempts: {e}")
+                    raise
+                await asyncio.sleep(1 * (attempt + 1))
+
+    # ── page validators ──────────────────────────────────────────────────────
+    async def get_page_state(self, url: str) -> dict | None:
+        async def _get(db, url):
+            async with db.execute(
+                "SELECT etag, last_modified, content_hash, processed_at FROM page_state WHERE url = ?",
+                (url,),
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None
+            return {"etag": row[0], "last_modified": row[1], "content_hash": row[2], "processed_at": row[3]}
+
+        return await self.execute_with_retry(_get, url)
+
+    async def touch_page(self, url: str):
+        """Record that `url` was checked and found unchanged."""
+        async def _touch(db, url):
+            await db.execute("UPDATE page_state SET checked_at = ? WHERE url = ?", (time.time(), url))
+
+        await self.execute_with_retry(_touch, url)
+
+    async def save_page_state(self, url: str, headers: dict | None, chash: str, processed: bool):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        now = time.time()
+
+        async def _save(db):
+            await db.execute(
+                """
+                INSERT INTO page_state (url, etag, last_modified, content_hash, checked_at, processed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    content_hash = excluded.content_hash,
+                    checked_at = excluded.checked_at,
+                    processed_at = COALESCE(excluded.processed_at, page_state.processed_at)
+                """,
+                (url, headers.get("etag"), headers.get("last-modified"), chash, now,
+                 now if processed else None),
+            )
+
+        await self.execute_with_retry(_save)
+
+
+class ConditionalChecker:
+    """
+    Cheap pre-flight for incremental crawls: a conditional GET carrying the
+    stored ETag / Last-Modified. A 304 means the page can be skipped without
+    launching a browser page at all.
+    """
+
+    def __init__(self, state: CrawlStateDB, max_age: float, max_connections: int = 16):
+        self.state = state
+        self.max_age = max_age
+        self.max_connections = max_connections
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=15),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._session.close()
+
+    async def unchanged(self, url: str) -> bool:
+        page = await self.state.get_page_state(url)
+        if not page or not (page["etag"] or page["last_modified"]):
+            return False
+        # Force a full pass now and then so competitor prices can't go stale forever.
+        if not page["processed_at"] or time.time() - page["processed_at"] > self.max_age:
+            return False
+
+        headers = {}
+        if page["etag"]:
+            headers["If-None-Match"] = page["etag"]
+        if page["last_modified"]:
+            headers["If-Modified-Since"] = page["last_modified"]
+        try:
+            async with self._session.get(url, headers=headers, allow_redirects=True) as resp:
+                if resp.status == 304:
+                    await self.state.touch_page(url)
+                    return True
+        except Exception as e:
+            print(f"[WARN] Conditional check failed for {url}: {e}")
+        return False
+
+
+class Frontier:
+    """
+    Resumable crawl frontier stored next to the page validators.
+
+    Every category and product URL of a run is recorded with a status
+    (discovered → in_progress → done, or failed) plus the Torob lookup status.
+    If the previous run never reached `finish()`, `open()` resumes it so a
+    killed job picks up where it stopped instead of starting from the home page.
+    """
+
+    def __init__(self, state: CrawlStateDB):
+        self.state = state
+        self.run_id: int | None = None
+        self.resumed = False
+
+    async def open(self) -> bool:
+        async def _open(db):
+            async with db.execute(
+                "SELECT run_id, finished_at FROM crawl_runs ORDER BY run_id DESC LIMIT 1"
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row and row[1] is None:
+                return row[0], True
+            # Older runs are no longer needed once a new one starts.
+            await db.execute("DELETE FROM frontier")
+            cursor = await db.execute("INSERT INTO crawl_runs (started_at) VALUES (?)", (time.time(),))
+            return cursor.lastrowid, False
+
+        self.run_id, self.resumed = await self.state.execute_with_retry(_open)
+        return self.resumed
+
+    async def finish(self):
+        async def _finish(db):
+            await db.execute(
+                "UPDATE crawl_runs SET finished_at = ? WHERE run_id = ?", (time.time(), self.run_id)
+            )
+
+        await self.state.execute_with_retry(_finish)
+
+    async def add(self, urls: list[str], kind: str):
+        """Record newly discovered URLs; already-known ones keep their status."""
+        now = time.time()
+
+        async def _add(db):
+            await db.executemany(
+                "INSERT OR IGNORE INTO frontier (run_id, url, kind, updated_at) VALUES (?, ?, ?, ?)",
+                [(self.run_id, url, kind, now) for url in urls],
+            )
+
+        if urls:
+            await self.state.execute_with_retry(_add)
+
+    async def set_status(self, urls: list[str], status: str, torob_status: str | None = None,
+                         payloads: dict[str, dict] | None = None):
+        now = time.time()
+        payloads = payloads or {}
+
+        async def _set(db):
+            await db.executemany(
+                """
+                UPDATE frontier SET
+                    status = ?,
+                    torob_status = COALESCE(?, torob_status),
+                    payload = COALESCE(?, payload),
+                    updated_at = ?
+                WHERE run_id = ? AND url = ?
+                """,
+                [
+                    (status, torob_status,
+                     json.dumps(payloads[url], ensure_ascii=False) if url in payloads else None,
+                     now, self.run_id, url)
+                    for url in urls
+                ],
+            )
+
+        if urls:
+            await self.state.execute_with_retry(_set)
+
+    async def urls(self, kind: str, pending_only: bool = False) -> list[str]:
+        """URLs of this run; with `pending_only`, those not yet done (interrupted or failed)."""
+        query = "SELECT url FROM frontier WHERE run_id = ? AND kind = ?"
+        if pending_only:
+            query += " AND status != 'done'"
+
+        async def _urls(db):
+            async with db.execute(query + " ORDER BY updated_at", (self.run_id, kind)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+        return await self.state.execute_with_retry(_urls)
+
+    async def torob_retries(self) -> list[dict]:
+        """Stored products whose page was processed but whose Torob lookup failed."""
+        async def _retries(db):
+            async with db.execute(
+                """
+                SELECT payload FROM frontier
+                WHERE run_id = ? AND kind = 'product' AND status = 'done'
+                  AND torob_status = 'failed' AND payload IS NOT NULL
+                """,
+                (self.run_id,),
+            ) as cursor:
+                return [json.loads(row[0]) for row in await cursor.fetchall()]
+
+        return await self.state.execute_with_retry(_retries)
@@ -1,26 +1,36 @@
 # crawler.py
 
 import os
-import re
 import json
+import time
 import asyncio
 
+from contextlib import AsyncExitStack, aclosing
+from datetime import datetime, timezone
 from difflib import SequenceMatcher
-from crawl4ai import AsyncWebCrawler
-from bs4 import BeautifulSoup
+from crawl4ai import AsyncWebCrawler, CacheMode, CrawlerRunConfig, MemoryAdaptiveDispatcher, RateLimiter
 from supabase import create_client, Client
-from torob_integration.api import Torob
 from uuid import uuid4
 
-# ─── 0) Try to load a local sentence-transformers model ───────────────────────
-# If you don't have `sentence-transformers` installed, run:
+from crawl_state import ConditionalChecker, CrawlStateDB, Frontier, content_hash
+from embeddings import get_embedding_service
+from page_extraction import ParsedPage
+from pipeline import DONE, run_stage
+from persian_text import normalize
+from price_history import PriceHistory
+from ranking import CandidateRanker
+from supabase_writer import BatchWriter
+from torob_client import AsyncTorobClient
+from torob_details import SellerDetailResolver
+
+# ─── 0) Shared sentence-transformers service ──────────────────────────────────
+# The model is loaded lazily on the first semantic score, so runs that never
+# reach Torob matching don't pay for it. If you don't have
+# `sentence-transformers` installed, run:
 #    pip install sentence-transformers
-try:
-    from sentence_transformers import SentenceTransformer
-    _LOCAL_EMBED_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
-except ImportError:
-    _LOCAL_EMBED_MODEL = None
-    print("[WARN] Could not import sentence-transformers → will fallback to fuzzy only.")
+# Embeddings are cached on disk by normalized-text hash, so titles seen in a
+# previous run are never re-encoded.
+_EMBEDDINGS = get_embedding_service()
 
 # ─── 1) Supabase configuration ──────────────────────────────────────────────
 SUPABASE_URL              = os.getenv("SUPABASE_URL")
@@ -32,35 +42,28 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 # ─── 2) Helper functions ─────────────────────────────────────────────────────
 
-def persian_to_english_numbers(text: str) -> str:
-    persian = "۰۱۲۳۴۵۶۷۸۹"
-    english = "0123456789"
-    return text.translate(str.maketrans(persian, english))
-
 def fuzzy_similarity(a: str, b: str) -> float:
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+    return SequenceMatcher(None, normalize(a), normalize(b)).ratio()
 
-def get_semantic_score(a: str, b: str) -> float:
+def get_semantic_scores(query: str, candidates: list[str]) -> list[float]:
     """
-    Compute cosine similarity of local embeddings via sentence-transformers.
-    If the local model is unavailable, return -1.0 to force a fuzzy-only fallback.
+    Cosine similarity of `query` against every candidate, encoded in one batch.
+    If the local model is unavailable, return -1.0 per candidate to force a
+    fuzzy-only fallback.
     """
-    if _LOCAL_EMBED_MODEL is None:
-        return -1.0
+    if not _EMBEDDINGS.available:
+        return [-1.0] * len(candidates)
 
     try:
-        # Encode both strings in a single batch for slight speedup
-        embeddings = _LOCAL_EMBED_MODEL.encode([a, b], convert_to_tensor=False)
-        emb_a, emb_b = embeddings[0], embeddings[1]
-        dot = sum(x*y for x,y in zip(emb_a, emb_b))
-        norm_a = sum(x*x for x in emb_a) ** 0.5
-        norm_b = sum(y*y for y in emb_b) ** 0.5
-        if norm_a == 0 or norm_b == 0:
-            return -1.0
-        return dot / (norm_a * norm_b)
+        return _EMBEDDINGS.scores(query, candidates).tolist()
     except Exception as e:
         print(f"[WARN] Local embedding error: {e} → falling back to fuzzy only.")
-        return -1.0
+        return [-1.0] * len(candidates)
+
+# Candidates scoring at least this are trusted without human review; their
+# semantic score is never computed since it couldn't change the outcome.
+REVIEW_THRESHOLD = 0.8
+RANKER = CandidateRanker(fuzzy_similarity, get_semantic_scores, k=5, accept=REVIEW_THRESHOLD)
 
 async def fetch_page(crawler: AsyncWebCrawler, url: str) -> str:
     res = await crawler.arun(url)
@@ -73,171 +76,369 @@ def extract_product_data(html: str) -> dict:
     """
     Parse a single Wiraa product page’s HTML and return {name, price}.
     """
-    soup = BeautifulSoup(html, "html.parser")
-    title_el = soup.select_one('h1[data-product="title"]')
-    name = title_el.get_text(strip=True) if title_el else "No Name"
-
-    price_el = soup.select_one("div.styles__price___1uiIp.js-price")
-    raw = price_el.get_text(strip=True) if price_el else "0"
-    digits = re.sub(r"[^\d]", "", persian_to_english_numbers(raw))
-    price = int(digits) if digits else 0
-
-    return {"name": name, "price": price}
-
-def extract_links(html: str, selector: str, base_url: str) -> list[str]:
+    return ParsedPage(html).product()
+
+# ─── 3) Pipeline configuration ───────────────────────────────────────────────
+# The crawl runs as a staged pipeline: category discovery → product fetch →
+# parse → Torob lookup → DB write. Stages talk through bounded queues so a slow
+# stage applies backpressure instead of buffering the whole catalog in memory.
+BASE_URL = "https://wiraa.ir"
+
+FETCH_WORKERS    = int(os.getenv("CRAWL_FETCH_WORKERS", "2"))     # concurrent arun_many batches
+FETCH_SESSIONS   = int(os.getenv("CRAWL_FETCH_SESSIONS", "6"))    # browser sessions per batch
+FETCH_BATCH_SIZE = int(os.getenv("CRAWL_FETCH_BATCH_SIZE", "24"))
+PARSE_WORKERS    = int(os.getenv("CRAWL_PARSE_WORKERS", "2"))
+TOROB_WORKERS    = int(os.getenv("CRAWL_TOROB_WORKERS", "4"))
+DB_WORKERS       = int(os.getenv("CRAWL_DB_WORKERS", "2"))
+DB_BATCH_SIZE    = int(os.getenv("CRAWL_DB_BATCH_SIZE", "200"))   # rows per bulk upsert
+DB_FLUSH_INTERVAL = float(os.getenv("CRAWL_DB_FLUSH_INTERVAL", "5"))  # seconds
+QUEUE_SIZE       = int(os.getenv("CRAWL_QUEUE_SIZE", "100"))
+TOROB_RATE       = float(os.getenv("TOROB_RATE", "2"))          # requests/sec to Torob
+TOROB_CACHE_TTL  = float(os.getenv("TOROB_CACHE_TTL", "10800"))  # seconds, one cron window
+TOROB_MAX_PAGES  = int(os.getenv("TOROB_MAX_PAGES", "3"))         # result pages per product, at most
+TOROB_CANDIDATE_BUDGET = int(os.getenv("TOROB_CANDIDATE_BUDGET", "72"))  # stop after scoring this many
+
+# Incremental mode skips products whose page validators (ETag/Last-Modified) or
+# extracted name+price hash match the previous run. Every product still gets a
+# full pass once REFRESH_AFTER has elapsed so competitor prices stay current.
+INCREMENTAL      = os.getenv("CRAWL_INCREMENTAL", "1") == "1"
+REFRESH_AFTER    = float(os.getenv("CRAWL_REFRESH_HOURS", "24")) * 3600
+
+# Resume mode records every category/product URL of a run in a local frontier;
+# a job killed midway continues the unfinished run on its next start.
+RESUME           = os.getenv("CRAWL_RESUME", "1") == "1"
+
+def make_dispatcher(max_sessions: int) -> MemoryAdaptiveDispatcher:
+    # A dispatcher keeps per-run queues, so every arun_many call gets its own.
+    return MemoryAdaptiveDispatcher(
+        max_session_permit=max_sessions,
+        rate_limiter=RateLimiter(base_delay=(0.5, 1.5), max_delay=30.0, max_retries=3),
+    )
+
+# ─── 4) Pipeline stages ──────────────────────────────────────────────────────
+async def discover_products(crawler: AsyncWebCrawler, outbox: asyncio.Queue, stats: dict,
+                            frontier: Frontier | None = None):
     """
-    Given HTML and a CSS selector, return unique absolute URLs from <a> tags matching that selector.
+    Stage 1: home page → categories → unique product URLs. When resuming an
+    interrupted run, the recorded frontier replaces the home page: unfinished
+    products are queued first and only unfinished categories are re-crawled.
     """
-    soup = BeautifulSoup(html, "html.parser")
-    results = []
-    for a in soup.select(selector):
-        href = a.get("href")
-        if not href:
-            continue
-        full = href if href.startswith("http") else base_url.rstrip("/") + href
-        if full not in results:
-            results.append(full)
-    return results
-
-# ─── 3) Main crawler logic ───────────────────────────────────────────────────
-async def main():
-    base_url = "https://wiraa.ir"
-    crawler = AsyncWebCrawler()
-    torob = Torob()
-
-    # 3.1) Fetch home page & extract category URLs
-    home_html = await fetch_page(crawler, base_url)
-    if not home_html:
-        print("[FATAL] Could not fetch the home page.")
-        return
-
-    categories = extract_links(home_html, "a[href^='/category/']", base_url)
-    print(f"[INFO] Found {len(categories)} categories on {base_url}")
-
-    for cat_url in categories:
-        print(f"\n[CATEGORY] {cat_url}")
-        cat_html = await fetch_page(crawler, cat_url)
-        if not cat_html:
-            continue
-
-        # 3.2) Extract all product URLs under that category
-        product_urls = extract_links(cat_html, "a[href^='/product/']", base_url)
-        print(f" → {len(product_urls)} products found in this category")
-
-        for prod_url in product_urls:
-            html = await fetch_page(crawler, prod_url)
-            if not html:
+    try:
+        seen = set()
+        categories = []
+        # A run that died before reading the home page has nothing to resume from.
+        if frontier is not None and frontier.resumed and await frontier.urls("category"):
+            seen.update(await frontier.urls("product"))
+            pending = await frontier.urls("product", pending_only=True)
+            categories = await frontier.urls("category", pending_only=True)
+            print(f"[RESUME] {len(pending)} unfinished products, {len(categories)} unfinished categories")
+            for url in pending:
+                await outbox.put(url)
+        else:
+            home_html = await fetch_page(crawler, BASE_URL)
+            if not home_html:
+                print("[FATAL] Could not fetch the home page.")
+                return
+
+            categories = ParsedPage(home_html).category_links(BASE_URL)
+            print(f"[INFO] Found {len(categories)} categories on {BASE_URL}")
+            if frontier is not None:
+                await frontier.add(categories, "category")
+
+        config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=True)
+        async for res in await crawler.arun_many(
+            categories, config=config, dispatcher=make_dispatcher(FETCH_SESSIONS)
+        ):
+            if not res.success:
+                print(f"[ERROR] Unable to fetch {res.url}")
                 continue
-
-            # 3.3) Extract name & price; compute slug (path after "/product/")
-            product = extract_product_data(html)
-            slug = prod_url.split("/product/", 1)[-1]
-            product["url"] = prod_url
-            product["product_slug"] = slug
-
-            # 3.4) Upsert into "products" (on_conflict="url")
-            upsert_resp = supabase.table("products").upsert(
-                {
-                    "name": product["name"],
-                    "price": product["price"],
-                    "url": product["url"],
-                    "product_slug": product["product_slug"],
-                },
-                on_conflict="url"
-            ).execute()
-
-            if upsert_resp.data is None:
-                print(f"[ERROR] Supabase returned no data when upserting {product['name']}")
+            product_urls = await asyncio.to_thread(
+                lambda html: ParsedPage(html).product_links(BASE_URL), res.html
+            )
+            fresh = [u for u in product_urls if u not in seen]
+            seen.update(fresh)
+            stats["categories"] += 1
+            print(f"[CATEGORY] {res.url} → {len(product_urls)} products ({len(fresh)} new)")
+            if frontier is not None:
+                await frontier.add(fresh, "product")
+                await frontier.set_status([res.url], "done")
+            for url in fresh:
+                await outbox.put(url)
+    finally:
+        for _ in range(FETCH_WORKERS):
+            await outbox.put(DONE)
+
+async def fetch_products(crawler: AsyncWebCrawler, inbox: asyncio.Queue,
+                         outbox: asyncio.Queue, stats: dict,
+                         checker: ConditionalChecker | None = None,
+                         frontier: Frontier | None = None):
+    """
+    Stage 2: drain product URLs in batches through arun_many. In incremental
+    mode, URLs whose stored ETag/Last-Modified still validate (HTTP 304) are
+    dropped before any browser page is opened.
+    """
+    config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=True)
+    finished = False
+    while not finished:
+        batch = []
+        item = await inbox.get()
+        while True:
+            if item is DONE:
+                finished = True
+                break
+            batch.append(item)
+            if len(batch) >= FETCH_BATCH_SIZE or inbox.empty():
+                break
+            item = inbox.get_nowait()
+        if checker is not None and batch:
+            unchanged = await asyncio.gather(*(checker.unchanged(u) for u in batch))
+            stats["unchanged"] += sum(unchanged)
+            if frontier is not None:
+                await frontier.set_status([u for u, same in zip(batch, unchanged) if same],
+                                          "done", torob_status="skipped")
+            batch = [u for u, same in zip(batch, unchanged) if not same]
+        if not batch:
+            continue
+        if frontier is not None:
+            await frontier.set_status(batch, "in_progress")
+
+        async for res in await crawler.arun_many(
+            batch, config=config, dispatcher=make_dispatcher(FETCH_SESSIONS)
+        ):
+            if not res.success or not res.html:
+                print(f"[ERROR] Unable to fetch {res.url}")
+                if frontier is not None:
+                    await frontier.set_status([res.url], "failed")
                 continue
+            stats["fetched"] += 1
+            await outbox.put((res.url, res.html, res.response_headers))
+
+def parse_product(url: str, html: str) -> dict:
+    # 3.3) Extract name & price; compute slug (path after "/product/")
+    product = extract_product_data(html)
+    product["url"] = url
+    product["product_slug"] = url.split("/product/", 1)[-1]
+    return product
+
+async def resolve_seller(details: SellerDetailResolver, item: dict) -> str:
+    raw_shop = (item.get("shop_text") or "").strip()
+    link_path = item.get("web_client_absolute_url") or item.get("more_info_url")
+    seller = raw_shop or "unknown"
+
+    # If “فروشگاه” appears, follow the detail page to extract up to 3 shop names
+    if "فروشگاه" in raw_shop and link_path:
+        shops = await details.shops(link_path)
+        if shops:
+            seller = ", ".join(shops)
+    return seller
+
+async def lookup_torob(torob: AsyncTorobClient, details: SellerDetailResolver, product: dict) -> dict:
+    """Stage 4: Torob search + scoring → a write job for the DB stage."""
+    job = {"product": product, "review": None, "competitors": [], "torob_status": "failed"}
+
+    # 3.6) Query Torob for competitor prices, page by page: each page is scored
+    # (3.7) while the next one downloads, and we stop once a candidate clears
+    # the review threshold or the candidate budget is spent.
+    ranking = RANKER.start(product["name"])
+    try:
+        async with aclosing(torob.iter_pages(product["name"], max_pages=TOROB_MAX_PAGES)) as pages:
+            async for torob_results in pages:
+                await asyncio.to_thread(ranking.add, torob_results)
+                if ranking.best >= REVIEW_THRESHOLD or ranking.seen >= TOROB_CANDIDATE_BUDGET:
+                    break
+    except Exception as e:
+        print(f"    ↳ Torob search failed for '{product['name']}': {e}")
+        if not ranking.seen:
+            return job
+        # A later page failed: the pages we already scored still count.
+
+    job["torob_status"] = "done"
+    top_five = ranking.results()
+
+    # 3.8) If best_score < REVIEW_THRESHOLD → insert into review_queue for human review
+    if top_five:
+        best_score, best_f, best_s, best_item = top_five[0]
+        if best_score < REVIEW_THRESHOLD:
+            job["review"] = (best_score, {
+                "id": str(uuid4()),
+                "product_slug": product["product_slug"],
+                "candidate_name": best_item.get("name1", ""),
+                "candidate_shop": best_item.get("shop_text", ""),
+                "fuzzy_score": float(round(best_f, 4)),
+                "semantic_score": float(round(best_s, 4)),
+                "raw_torob_data": json.dumps(best_item, ensure_ascii=False)
+            })
+
+    # 3.9) Resolve sellers for the top-3 matches (detail pages fetched concurrently)
+    top_three = top_five[:3]
+    sellers = await asyncio.gather(*(resolve_seller(details, item) for *_, item in top_three))
+    for (final_score, f_sc, s_sc, item), seller in zip(top_three, sellers):
+        job["competitors"].append((final_score, {
+            "product_slug": product["product_slug"],
+            "competitor_name": seller,
+            "competitor_price": item.get("price", 0)
+        }))
+    return job
+
+async def write_job(writer: BatchWriter, job: dict, history: PriceHistory | None = None):
+    """
+    Stage 5: buffer one product with its review candidate and competitor
+    prices. With a price history, only prices that changed since the last
+    recorded point are written.
+    """
+    product = job["product"]
+    group = product["url"]   # ties every row below to the checkpoint token
+    observed_at = time.time()
+
+    # 3.4) Upsert into "products" (on_conflict="url"). updated_at is the
+    # matcher's sync watermark (supplier_ingest/catalog.py); the table has no
+    # trigger for it, so every write stamps it here.
+    await writer.upsert("products", {
+        "name": product["name"],
+        "price": product["price"],
+        "url": product["url"],
+        "product_slug": product["product_slug"],
+        "updated_at": datetime.fromtimestamp(observed_at, timezone.utc).isoformat(),
+    }, on_conflict="url", group=group)
+    print(f"  • Stored product: {product['name']} (slug={product['product_slug']})")
+
+    if job["review"]:
+        best_score, review_row = job["review"]
+        await writer.insert("review_queue", review_row, group=group)
+        print(f"    [REVIEW] Queued '{review_row['candidate_name']}' (score={best_score:.3f})")
+
+    # One row per seller (the last wins, as in the upsert), so a seller listed
+    # twice at different prices doesn't look like a change on every run.
+    rows = list({(r["product_slug"], r["competitor_name"]): r for _, r in job["competitors"]}.values())
+    changed = history.changed(rows) if history is not None else rows
+    for idx, (final_score, row) in enumerate(job["competitors"]):
+        if row not in changed:
+            print(f"    ↳ [{idx+1}] {row['competitor_name']}: {row['competitor_price']} تومان (unchanged)")
+            continue
+        await writer.upsert("competitor_prices", row, on_conflict="product_slug,competitor_name", group=group)
+        print(f"    ↳ [{idx+1}] {row['competitor_name']}: {row['competitor_price']} تومان (score={final_score:.3f})")
 
-            print(f"  • Stored product: {product['name']} (slug={slug})")
-
-            # 3.5) (Optional) retrieve the UUID if needed:
-            # fetch_id = supabase.table("products") \
-            #                    .select("id") \
-            #                    .eq("product_slug", slug) \
-            #                    .single() \
-            #                    .execute()
-            # product_id = fetch_id.data["id"]
-
-            # 3.6) Query Torob for competitor prices
-            try:
-                torob_resp = torob.search(q=product["name"], page=0)
-                torob_results = torob_resp.get("results", [])
-            except Exception as e:
-                print(f"    ↳ Torob search failed for '{product['name']}': {e}")
-                continue
+    # Checkpoint token: confirmed once everything above has been flushed (and
+    # dropped if any of it failed), so the history only records prices that
+    # actually reached Supabase.
+    writer.mark((product, job["torob_status"], changed, observed_at), group=group)
 
-            # 3.7) Score each Torob candidate (fuzzy + semantic)
-            scored = []
-            for item in torob_results:
-                name1 = item.get("name1", "")
-                f_score = fuzzy_similarity(name1, product["name"])
-                s_score = get_semantic_score(name1, product["name"])
-                final_score = f_score if s_score < 0 else max(f_score, s_score)
-                scored.append((final_score, f_score, s_score, item))
-
-            scored.sort(key=lambda x: x[0], reverse=True)
-            top_five = scored[:5]
-
-            # 3.8) If best_score < 0.5 → insert into review_queue for human review
-            if top_five:
-                best_score, best_f, best_s, best_item = top_five[0]
-                if best_score < 0.8:
-                    review_resp = supabase.table("review_queue").insert({
-                        "id": str(uuid4()),
-                        "product_slug": slug,
-                        "candidate_name": best_item.get("name1", ""),
-                        "candidate_shop": best_item.get("shop_text", ""),
-                        "fuzzy_score": float(round(best_f, 4)),
-                        "semantic_score": float(round(best_s, 4)),
-                        "raw_torob_data": json.dumps(best_item, ensure_ascii=False)
-                    }).execute()
-
-                    if review_resp.data is None:
-                        print(f"[WARN] Couldn’t queue '{best_item.get('name1','')}' for review.")
-                    else:
-                        print(f"    [REVIEW] Queued '{best_item.get('name1','')}' (score={best_score:.3f})")
-
-            # 3.9) Upsert the top-3 matches into competitor_prices
-            for idx, (final_score, f_sc, s_sc, item) in enumerate(top_five[:3]):
-                comp_price = item.get("price", 0)
-                raw_shop = (item.get("shop_text") or "").strip()
-                link_path = item.get("web_client_absolute_url") or item.get("more_info_url")
-                seller = raw_shop or "unknown"
-
-                # If “فروشگاه” appears, follow the detail page to extract up to 3 shop names
-                if "فروشگاه" in raw_shop and link_path:
-                    detail_url = link_path if link_path.startswith("http") else "https://torob.com" + link_path
-                    detail_html = await fetch_page(crawler, detail_url)
-                    if detail_html:
-                        dsoup = BeautifulSoup(detail_html, "html.parser")
-                        shops = []
-                        for a_tag in dsoup.select("a.shop-name"):
-                            txt = a_tag.get_text(strip=True).split(",")[0].strip()
-                            if txt and txt not in shops:
-                                shops.append(txt)
-                            if len(shops) >= 3:
-                                break
-                        if shops:
-                            seller = ", ".join(shops)
-
-                comp_resp = supabase.table("competitor_prices").upsert(
-                    {
-                        "product_slug": slug,
-                        "competitor_name": seller,
-                        "competitor_price": comp_price
-                    },
-                    on_conflict="product_slug,competitor_name"
-                ).execute()
-
-                if comp_resp.data is None:
-                    print(f"[WARN] Couldn’t upsert competitor_price '{seller}' for '{product['name']}'")
-                else:
-                    print(f"    ↳ [{idx+1}] {seller}: {comp_price} تومان (score={final_score:.3f})")
-
-    print("\n[Crawling Completed]")
-
-# ─── 4) Entry Point ───────────────────────────────────────────────────────────
+# ─── 5) Main crawler logic ───────────────────────────────────────────────────
+async def main():
+    stats = {"categories": 0, "fetched": 0, "parsed": 0, "unchanged": 0, "written": 0}
+    pending_state = {}   # url → (response headers, content hash) awaiting a confirmed flush
+
+    product_urls = asyncio.Queue(maxsize=QUEUE_SIZE)
+    pages        = asyncio.Queue(maxsize=QUEUE_SIZE)
+    products     = asyncio.Queue(maxsize=QUEUE_SIZE)
+    writes       = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def parse(page):
+        url, html, headers = page
+        product = await asyncio.to_thread(parse_product, url, html)
+        stats["parsed"] += 1
+        if INCREMENTAL:
+            # Same name & price as last time → skip Torob and DB work entirely.
+            chash = content_hash(product)
+            previous = await state.get_page_state(url)
+            if (previous and previous["content_hash"] == chash and previous["processed_at"]
+                    and time.time() - previous["processed_at"] <= REFRESH_AFTER):
+                await state.save_page_state(url, headers, chash, processed=False)
+                if frontier is not None:
+                    await frontier.set_status([url], "done", torob_status="skipped")
+                stats["unchanged"] += 1
+                return None
+            pending_state[url] = (headers, chash)
+        return product
+
+    async def parse_stage():
+        # Products whose page made it to the DB but whose Torob lookup failed
+        # in the interrupted run only need the Torob stage again.
+        if frontier is not None and frontier.resumed:
+            for product in await frontier.torob_retries():
+                await products.put(product)
+        await run_stage(pages, parse, PARSE_WORKERS, products, TOROB_WORKERS)
+
+    async def torob_stage(product):
+        return await lookup_torob(torob, details, product)
+
+    async def write(job):
+        await write_job(writer, job, history)
+        stats["written"] += 1
+
+    async def on_flush(tokens):
+        # Runs only after the batches holding these products are in Supabase.
+        for product, torob_status, prices, observed_at in tokens:
+            history.record(prices, observed_at)
+            url = product["url"]
+            if url in pending_state:
+                # Only a finished Torob lookup counts as processed; otherwise
+                # the next run's hash/304 checks would skip the product and
+                # leave it without competitor prices until the refresh.
+                headers, chash = pending_state.pop(url)
+                await state.save_page_state(url, headers, chash, processed=torob_status == "done")
+            if frontier is not None:
+                await frontier.set_status([url], "done", torob_status=torob_status,
+                                          payloads={url: product})
+
+    async def fetch_stage():
+        await asyncio.gather(*(
+            fetch_products(crawler, product_urls, pages, stats, checker, frontier)
+            for _ in range(FETCH_WORKERS)
+        ))
+        for _ in range(PARSE_WORKERS):
+            await pages.put(DONE)
+
+    history = PriceHistory()
+
+    async with AsyncExitStack() as stack:
+        state = checker = frontier = None
+        if INCREMENTAL or RESUME:
+            state = await stack.enter_async_context(CrawlStateDB())
+        if INCREMENTAL:
+            checker = await stack.enter_async_context(ConditionalChecker(state, REFRESH_AFTER))
+        if RESUME:
+            frontier = Frontier(state)
+            await frontier.open()
+        crawler = await stack.enter_async_context(AsyncWebCrawler())
+        writer = await stack.enter_async_context(BatchWriter(
+            supabase, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL,
+            on_flush=on_flush,
+        ))
+        torob = await stack.enter_async_context(
+            AsyncTorobClient(rate=TOROB_RATE, cache_ttl=TOROB_CACHE_TTL)
+        )
+        details = await stack.enter_async_context(SellerDetailResolver(cache_ttl=TOROB_CACHE_TTL))
+
+        await asyncio.gather(
+            discover_products(crawler, product_urls, stats, frontier),
+            fetch_stage(),
+            parse_stage(),
+            run_stage(products, torob_stage, TOROB_WORKERS, writes, DB_WORKERS),
+            run_stage(writes, write, DB_WORKERS),
+        )
+        # Flush while the state DB is still open so the last checkpoints land.
+        await writer.flush()
+        if frontier is not None:
+            await frontier.finish()
+
+    _EMBEDDINGS.save()
+    print(
+        f"\n[Crawling Completed] categories={stats['categories']} fetched={stats['fetched']} "
+        f"parsed={stats['parsed']} unchanged={stats['unchanged']} written={stats['written']} "
+        f"db_batches={writer.stats['batches']} db_failed_rows={writer.stats['failed_rows']} "
+        f"torob_requests={torob.stats['requests']} torob_cache_hits={torob.stats['cache_hits']} "
+        f"torob_pages={torob.stats['pages']} torob_prefetch_cancelled={torob.stats['prefetch_cancelled']} "
+        f"detail_fetches={details.stats['fetches']} detail_cache_hits={details.stats['cache_hits']} "
+        f"price_changes={history.stats['recorded']} new_sellers={history.stats['new_series']}"
+    )
+    ranking = RANKER.summary()
+    print(
+        f"[Ranking] products={ranking['products']} candidates={ranking['candidates']} "
+        f"semantic_skipped={ranking['semantic_skipped']} "
+        f"p50={ranking['p50_ms']}ms p95={ranking['p95_ms']}ms max={ranking['max_ms']}ms"
+    )
+
+# ─── 6) Entry Point ───────────────────────────────────────────────────────────
 if __name__ == "__main__":
     asyncio.run(main())
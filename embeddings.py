@@ -0,0 +1,225 @@
+# embeddings.py
+
+import hashlib
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from persian_text import clean
+from storage import data_path
+
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+# Least recently used vectors beyond this are dropped when the cache is saved,
+# so the file carried between CI runs stays bounded.
+CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+
+def normalize_text(text: str) -> str:
+    return clean(text).lower()
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def cosine_similarities(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """Cosine similarity of one vector against every row of `matrix`, in one matmul."""
+    if matrix.size == 0:
+        return np.zeros(0, dtype=np.float32)
+    q_norm = np.linalg.norm(query)
+    m_norm = np.linalg.norm(matrix, axis=1)
+    denom = m_norm * q_norm
+    sims = matrix @ query
+    return np.divide(sims, denom, out=np.full_like(sims, -1.0), where=denom > 0)
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of text embeddings keyed by a hash of the normalized text.
+
+    Vectors live in one float32 matrix plus a key → row index, saved together as
+    an .npz file so repeat runs never re-encode the same product titles. The
+    matrix grows by doubling (only the first `_size` rows are live), and each
+    row remembers when it was last used so `save()` can keep the
+    `max_entries` most recently used ones.
+    """
+
+    def __init__(self, model_name: str, path: str | None = None, max_entries: int = CACHE_MAX_ENTRIES):
+        safe_name = model_name.replace("/", "__")
+        self.path = path or data_path("embeddings", f"{safe_name}.npz")
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._index: dict[str, int] = {}
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._used = np.zeros(0, dtype=np.int64)
+        self._size = 0
+        self._tick = 0
+        self._dirty = False
+        self._load()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                keys = data["keys"].tolist()
+                vectors = data["vectors"].astype(np.float32, copy=False)
+                used = data["used"] if "used" in data.files else np.zeros(len(keys), dtype=np.int64)
+            self._vectors, self._used, self._size = vectors, used.astype(np.int64), len(keys)
+            self._tick = int(used.max()) if len(used) else 0
+            self._index = {k: i for i, k in enumerate(keys)}
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable embedding cache {self.path}: {e}")
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            keys = np.array(sorted(self._index, key=self._index.get))
+            rows = np.arange(self._size)
+            if self._size > self.max_entries:
+                rows = np.sort(np.argsort(self._used[:self._size], kind="stable")[-self.max_entries:])
+                keys = keys[rows]
+            vectors, used = self._vectors[rows], self._used[rows]
+            tmp = self.path + ".tmp.npz"
+            np.savez(tmp, keys=keys, vectors=vectors, used=used)
+            os.replace(tmp, self.path)
+            if len(rows) < self._size:
+                self._vectors, self._used, self._size = vectors, used, len(rows)
+                self._index = {k: i for i, k in enumerate(keys.tolist())}
+            self._dirty = False
+
+    def _reserve(self, extra: int, dim: int):
+        """Make room for `extra` more rows, doubling capacity so appends stay amortised O(1)."""
+        need = self._size + extra
+        if self._vectors.shape[0] >= need and self._vectors.shape[1] == dim:
+            return
+        capacity = max(need, 2 * self._vectors.shape[0], 1024)
+        vectors = np.zeros((capacity, dim), dtype=np.float32)
+        used = np.zeros(capacity, dtype=np.int64)
+        if self._size:
+            vectors[:self._size] = self._vectors[:self._size]
+            used[:self._size] = self._used[:self._size]
+        self._vectors, self._used = vectors, used
+
+    def encode(self, model, texts: list[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Return one embedding row per text, encoding only the cache misses and
+        doing so in a single batched `model.encode` call.
+        """
+        keys = [text_key(t) for t in texts]
+        with self._lock:
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._index and key not in missing:
+                    missing[key] = normalize_text(text)
+
+        if missing:
+            fresh = np.asarray(
+                model.encode(list(missing.values()), batch_size=batch_size, convert_to_numpy=True),
+                dtype=np.float32,
+            )
+            with self._lock:
+                new_rows = [(k, v) for k, v in zip(missing, fresh) if k not in self._index]
+                if new_rows:
+                    self._reserve(len(new_rows), fresh.shape[1])
+                    start = self._size
+                    self._vectors[start:start + len(new_rows)] = np.stack([v for _, v in new_rows])
+                    for offset, (k, _) in enumerate(new_rows):
+                        self._index[k] = start + offset
+                    self._size += len(new_rows)
+                    self._dirty = True
+
+        with self._lock:
+            rows = [self._index[k] for k in keys]
+            self._tick += 1
+            self._used[rows] = self._tick
+            self._dirty = True
+            return self._vectors[rows]
+
+
+class EmbeddingService:
+    """
+    Process-wide sentence-transformer wrapper that loads the model on first use.
+
+    Device and batch size follow crawl4ai.model_loader (CUDA/MPS when present,
+    memory-based batch size) and fall back to CPU/16 where crawl4ai isn't
+    installed, e.g. in supplier_ingest jobs. Encodings go through an
+    EmbeddingCache so every caller shares the same on-disk vectors.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME):
+        self.model_name = model_name
+        self.batch_size = 16
+        self._model = None
+        self._cache: EmbeddingCache | None = None
+        self._unavailable = False
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return self.model is not None
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = EmbeddingCache(self.model_name)
+        return self._cache
+
+    @property
+    def model(self):
+        if self._model is None and not self._unavailable:
+            with self._lock:
+                if self._model is None and not self._unavailable:
+                    self._model = self._load()
+                    self._unavailable = self._model is None
+        return self._model
+
+    def _load(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            print("[WARN] Could not import sentence-transformers → will fallback to fuzzy only.")
+            return None
+
+        device = "cpu"
+        try:
+            from crawl4ai.model_loader import calculate_batch_size, get_device
+            torch_device = get_device()
+            device = str(torch_device)
+            self.batch_size = calculate_batch_size(torch_device)
+        except ImportError:
+            pass
+
+        print(f"[INFO] Loading embedding model {self.model_name} on {device} (batch={self.batch_size})")
+        return SentenceTransformer(self.model_name, device=device)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self.cache.encode(self.model, texts, self.batch_size)
+
+    def scores(self, query: str, candidates: list[str]) -> np.ndarray:
+        """
+        Scores one query against all of its candidates: everything is encoded
+        together (through the cache) and compared in one matrix op.
+        """
+        if not candidates:
+            return np.zeros(0, dtype=np.float32)
+        vectors = self.encode([query, *candidates])
+        return cosine_similarities(vectors[0], vectors[1:])
+
+    def save(self):
+        if self._cache is not None:
+            self._cache.save()
+
+
+@lru_cache()
+def get_embedding_service(model_name: str = DEFAULT_MODEL_NAME) -> EmbeddingService:
+    """Shared EmbeddingService per model name; nothing is loaded until first use."""
+    return EmbeddingService(model_name)
@@ -1,7 +1,10 @@
 import os
-from torob_integration.api import Torob
+import asyncio
 from supabase import create_client
 
+from price_history import PriceHistory
+from torob_client import AsyncTorobClient
+
 # Supabase settings from environment
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -35,16 +38,25 @@ def upsert_competitor_price(slug: str, seller: str, price: int):
         on_conflict="product_slug,competitor_name"
     ).execute()
 
-# Fetch from Torob and store
-def fetch_and_store():
-    torob = Torob()
-    for slug in PRODUCT_SLUGS:
-        results = torob.search(slug, page=0)
-        for item in results.get("results", []):
-            seller = item.get("seller_name")
-            price  = int(item.get("price", 0))
-            print(f"[{slug}] {seller} → {price}")
-            upsert_competitor_price(slug, seller, price)
+# Fetch from Torob and store (only prices that changed since the last run)
+async def fetch_slug(torob: AsyncTorobClient, history: PriceHistory, slug: str):
+    results = await torob.search(slug, page=0)
+    for item in results.get("results", []):
+        seller = item.get("seller_name")
+        price  = int(item.get("price", 0))
+        row = {"product_slug": slug, "competitor_name": seller, "competitor_price": price}
+        if not history.changed([row]):
+            print(f"[{slug}] {seller} → {price} (unchanged)")
+            continue
+        print(f"[{slug}] {seller} → {price}")
+        await asyncio.to_thread(upsert_competitor_price, slug, seller, price)
+        history.record([row])
+
+async def fetch_and_store():
+    # Searches run concurrently; the client's rate limit and cache keep Torob load flat.
+    history = PriceHistory()
+    async with AsyncTorobClient() as torob:
+        await asyncio.gather(*(fetch_slug(torob, history, slug) for slug in PRODUCT_SLUGS))
 
 if __name__ == "__main__":
-    fetch_and_store()
\ No newline at end of file
+    asyncio.run(fetch_and_store())
@@ -0,0 +1,167 @@
+# page_extraction.py
+
+import re
+import threading
+
+from crawl4ai.extraction_strategy import JsonLxmlExtractionStrategy
+
+from persian_text import to_english_digits
+
+# ─── Schemas ─────────────────────────────────────────────────────────────────
+# One JsonLxmlExtractionStrategy schema per thing we pull out of a page. They
+# all run against the same parsed lxml tree (see ParsedPage).
+PRODUCT_SCHEMA = {
+    "name": "wiraa_product",
+    "baseSelector": "html",
+    "fields": [
+        {"name": "name", "selector": 'h1[data-product="title"]', "type": "text", "default": "No Name"},
+        {"name": "raw_price", "selector": "div.styles__price___1uiIp.js-price", "type": "text", "default": "0"},
+    ],
+}
+
+CATEGORY_LINKS_SCHEMA = {
+    "name": "wiraa_category_links",
+    "baseSelector": "a[href^='/category/']",
+    "fields": [{"name": "href", "type": "attribute", "attribute": "href"}],
+}
+
+PRODUCT_LINKS_SCHEMA = {
+    "name": "wiraa_product_links",
+    "baseSelector": "a[href^='/product/']",
+    "fields": [{"name": "href", "type": "attribute", "attribute": "href"}],
+}
+
+PRODUCT_CARDS_SCHEMA = {
+    "name": "wiraa_product_cards",
+    "baseSelector": "a.product-card__link",
+    "fields": [{"name": "href", "type": "attribute", "attribute": "href"}],
+}
+
+PAGINATION_SCHEMA = {
+    "name": "wiraa_pagination",
+    "baseSelector": "a[href*='page=']",
+    "fields": [{"name": "href", "type": "attribute", "attribute": "href"}],
+}
+
+TOROB_SHOPS_SCHEMA = {
+    "name": "torob_shops",
+    "baseSelector": "a.shop-name",
+    "fields": [{"name": "shop", "type": "text"}],
+}
+
+_PAGE_RE = re.compile(r"[?&]page=(\d+)")
+
+
+class TreeExtractionStrategy(JsonLxmlExtractionStrategy):
+    """
+    JsonLxmlExtractionStrategy that runs on an already-parsed tree.
+
+    Selectors are compiled once per strategy and applied exactly: the base
+    class' selector rewriting and per-element result cache are disabled because
+    strategies here are long-lived and shared across many documents.
+    """
+
+    def __init__(self, schema: dict, **kwargs):
+        kwargs.setdefault("use_caching", False)
+        kwargs.setdefault("optimize_common_patterns", False)
+        super().__init__(schema, **kwargs)
+
+    def _get_elements(self, element, selector: str):
+        # No fuzzy fallbacks: a missing title should give the default, not some other <h1>.
+        return self._get_selector(selector)(element, context_sensitive=False)
+
+    def extract_tree(self, tree) -> list[dict]:
+        results = []
+        for element in self._get_base_elements(tree, self.schema["baseSelector"]):
+            item = self._extract_item(element, self.schema["fields"])
+            if item:
+                results.append(item)
+        return results
+
+
+_SCHEMAS = {
+    "product": PRODUCT_SCHEMA,
+    "category_links": CATEGORY_LINKS_SCHEMA,
+    "product_links": PRODUCT_LINKS_SCHEMA,
+    "product_cards": PRODUCT_CARDS_SCHEMA,
+    "pagination": PAGINATION_SCHEMA,
+    "torob_shops": TOROB_SHOPS_SCHEMA,
+}
+_local = threading.local()
+
+
+def _strategy(name: str) -> TreeExtractionStrategy:
+    # Compiled lxml selectors aren't shared across threads, so each parse
+    # worker thread keeps its own set of strategies.
+    strategies = getattr(_local, "strategies", None)
+    if strategies is None:
+        strategies = _local.strategies = {}
+    if name not in strategies:
+        strategies[name] = TreeExtractionStrategy(_SCHEMAS[name])
+    return strategies[name]
+
+
+def parse_price(raw: str) -> int:
+    digits = re.sub(r"[^\d]", "", to_english_digits(raw))
+    return int(digits) if digits else 0
+
+
+class ParsedPage:
+    """
+    One lxml parse of a page, shared by every extraction we need from it.
+
+        page = ParsedPage(html)
+        page.product(); page.product_links(base_url); page.last_page()
+    """
+
+    def __init__(self, html: str):
+        self.tree = _strategy("product")._parse_html(html)
+
+    def product(self) -> dict:
+        items = _strategy("product").extract_tree(self.tree)
+        item = items[0] if items else {}
+        return {
+            "name": item.get("name") or "No Name",
+            "price": parse_price(item.get("raw_price") or "0"),
+        }
+
+    def _links(self, schema: str, base_url: str) -> list[str]:
+        results = []
+        seen = set()
+        for item in _strategy(schema).extract_tree(self.tree):
+            href = item.get("href")
+            if not href:
+                continue
+            full = href if href.startswith("http") else base_url.rstrip("/") + href
+            if full not in seen:
+                seen.add(full)
+                results.append(full)
+        return results
+
+    def category_links(self, base_url: str) -> list[str]:
+        return self._links("category_links", base_url)
+
+    def product_links(self, base_url: str) -> list[str]:
+        return self._links("product_links", base_url)
+
+    def product_card_links(self, base_url: str) -> list[str]:
+        return self._links("product_cards", base_url)
+
+    def last_page(self) -> int:
+        """Highest ?page=N linked from the page's pagination (1 if there is none)."""
+        pages = [1]
+        for item in _strategy("pagination").extract_tree(self.tree):
+            m = _PAGE_RE.search(item.get("href") or "")
+            if m:
+                pages.append(int(m.group(1)))
+        return max(pages)
+
+    def torob_shops(self, limit: int = 3) -> list[str]:
+        shops = []
+        for item in _strategy("torob_shops").extract_tree(self.tree):
+            txt = (item.get("shop") or "").split(",")[0].strip()
+            if txt and txt not in shops:
+                shops.append(txt)
+            if len(shops) >= limit:
+                break
+        return shops
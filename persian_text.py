@@ -0,0 +1,63 @@
+# persian_text.py
+
+import string
+import unicodedata
+from functools import lru_cache
+
+# ─── Translation tables (built once at import) ───────────────────────────────
+_DIGITS = {
+    **{d: str(i) for i, d in enumerate("۰۱۲۳۴۵۶۷۸۹")},   # Persian
+    **{d: str(i) for i, d in enumerate("٠١٢٣٤٥٦٧٨٩")},   # Arabic-Indic
+}
+
+_LETTERS = {
+    "ي": "ی", "ى": "ی", "ئ": "ی",      # Arabic yeh / alef maksura / yeh with hamza
+    "ك": "ک",                           # Arabic kaf
+    "ة": "ه", "ۀ": "ه", "ہ": "ه",        # teh marbuta / heh variants
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ؤ": "و",
+}
+
+_SPACES = {
+    "\u200c": " ",   # ZWNJ (نیم‌فاصله): "گوشی‌ها" and "گوشی ها" should tokenize alike
+    "\u200d": None, "\u200e": None, "\u200f": None, "\ufeff": None,
+    "\u00a0": " ",
+}
+
+# Harakat, tanwin, superscript alef and tatweel carry no meaning for matching.
+_DROP = {chr(c): None for c in range(0x064B, 0x0653)}
+_DROP.update({"\u0670": None, "\u0640": None})
+
+_PUNCTUATION = {c: " " for c in string.punctuation + "،؛؟«»٪×÷–—…"}
+
+DIGITS_TABLE = str.maketrans(_DIGITS)
+CLEAN_TABLE = str.maketrans({**_DIGITS, **_LETTERS, **_SPACES, **_DROP})
+MATCH_TABLE = str.maketrans({**_DIGITS, **_LETTERS, **_SPACES, **_DROP, **_PUNCTUATION})
+
+
+def to_english_digits(text: str) -> str:
+    return text.translate(DIGITS_TABLE)
+
+
+@lru_cache(maxsize=65536)
+def clean(text: str) -> str:
+    """
+    Unify Arabic/Persian letter forms and digits, drop diacritics and collapse
+    whitespace. Keeps case and punctuation, so it's safe for stored text.
+    """
+    if not text:
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", text).translate(CLEAN_TABLE).split())
+
+
+@lru_cache(maxsize=65536)
+def normalize(text: str) -> str:
+    """Matching key: `clean` plus lower-casing and punctuation → space."""
+    if not text:
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", text).translate(MATCH_TABLE).lower().split())
+
+
+@lru_cache(maxsize=65536)
+def tokens(text: str) -> tuple[str, ...]:
+    return tuple(normalize(text).split())
@@ -0,0 +1,33 @@
+# pipeline.py
+
+import asyncio
+
+DONE = object()   # end-of-stream marker, one per downstream worker
+
+
+async def run_stage(inbox: asyncio.Queue, handler, workers: int,
+                    outbox: asyncio.Queue | None = None, downstream: int = 0):
+    """
+    Run `workers` copies of `handler` over `inbox` until each one receives DONE.
+    Non-None handler results go to `outbox`; once all workers exit, `downstream`
+    end markers are forwarded so the next stage shuts down in turn.
+
+    Shared by the crawler and the Telegram ingest pipeline.
+    """
+    async def worker():
+        while True:
+            item = await inbox.get()
+            if item is DONE:
+                return
+            try:
+                result = await handler(item)
+            except Exception as e:
+                print(f"[ERROR] {handler.__name__} failed: {e}")
+                continue
+            if outbox is not None and result is not None:
+                await outbox.put(result)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if outbox is not None:
+        for _ in range(downstream):
+            await outbox.put(DONE)
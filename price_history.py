@@ -0,0 +1,188 @@
+# price_history.py
+
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from storage import data_path
+
+# One change point: series id, seconds since the series' previous point, and
+# price change since it. The first point of a series is relative to (0, 0).
+POINT_DTYPE = np.dtype([("series", "<u4"), ("dt", "<u4"), ("dprice", "<i8")])
+
+
+def _group_cumsum(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    """Running sum of `values` restarting at every change of (sorted) `groups`."""
+    if not len(values):
+        return values
+    total = np.cumsum(values)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    offsets = total[starts] - values[starts]
+    return total - np.repeat(offsets, np.diff(np.r_[starts, len(values)]))
+
+
+class PriceHistory:
+    """
+    Append-only competitor price history, one series per
+    (product_slug, competitor_name).
+
+    A point is recorded only when a seller's price actually changes. On disk,
+    series keys are appended to series.jsonl and points to points.bin as
+    16-byte delta records (POINT_DTYPE); nothing is ever rewritten. The log is
+    decoded into columns sorted by (series, time) for point-in-time queries,
+    and the latest price per series is kept in flat arrays so change checks
+    and `latest()` never touch the log.
+
+        history = PriceHistory()
+        fresh = history.changed(rows)      # competitor_prices rows worth writing
+        ...write them...
+        history.record(fresh)
+        history.latest("some-slug")        # current price per seller
+        history.price_at(ts, "some-slug")  # price per seller as of ts
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.path.dirname(data_path("price_history", "points.bin"))
+        os.makedirs(self.path, exist_ok=True)
+        self._keys_path = os.path.join(self.path, "series.jsonl")
+        self._points_path = os.path.join(self.path, "points.bin")
+        self.keys: list[tuple[str, str]] = []
+        self._ids: dict[tuple[str, str], int] = {}
+        self._by_product: dict[str, list[int]] = defaultdict(list)
+        self.stats = {"recorded": 0, "new_series": 0}
+
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._register(tuple(json.loads(line)))
+        self._raw = self._read_points()
+        self._decode()
+
+    # ── storage ──────────────────────────────────────────────────────────────
+    def _register(self, key: tuple[str, str]) -> int:
+        sid = self._ids[key] = len(self.keys)
+        self.keys.append(key)
+        self._by_product[key[0]].append(sid)
+        return sid
+
+    def _read_points(self) -> np.ndarray:
+        if not os.path.exists(self._points_path):
+            return np.empty(0, dtype=POINT_DTYPE)
+        size = os.path.getsize(self._points_path)
+        count = size // POINT_DTYPE.itemsize
+        if size % POINT_DTYPE.itemsize:
+            # A run killed mid-append leaves a partial record; drop it.
+            with open(self._points_path, "r+b") as f:
+                f.truncate(count * POINT_DTYPE.itemsize)
+        raw = np.fromfile(self._points_path, dtype=POINT_DTYPE, count=count)
+        return raw[raw["series"] < len(self.keys)]
+
+    def _decode(self):
+        order = np.argsort(self._raw["series"], kind="stable")
+        self.series = self._raw["series"][order].astype(np.int64)
+        self.t = _group_cumsum(self._raw["dt"][order].astype(np.int64), self.series)
+        self.price = _group_cumsum(self._raw["dprice"][order], self.series)
+        self._stale = False
+
+        self._last_t = np.zeros(len(self.keys), dtype=np.int64)
+        self._last_price = np.full(len(self.keys), -1, dtype=np.int64)   # -1: no point yet
+        if len(self.series):
+            ends = np.flatnonzero(np.r_[self.series[1:] != self.series[:-1], True])
+            self._last_t[self.series[ends]] = self.t[ends]
+            self._last_price[self.series[ends]] = self.price[ends]
+
+    def _columns(self):
+        if self._stale:
+            self._decode()
+        return self.series, self.t, self.price
+
+    # ── writes ───────────────────────────────────────────────────────────────
+    @staticmethod
+    def _key(row: dict) -> tuple[str, str]:
+        return row["product_slug"], row["competitor_name"]
+
+    def _current(self, key: tuple[str, str]) -> int:
+        sid = self._ids.get(key)
+        return -1 if sid is None else int(self._last_price[sid])
+
+    def changed(self, rows: list[dict]) -> list[dict]:
+        """competitor_prices rows whose price differs from the last recorded one."""
+        return [r for r in rows if self._current(self._key(r)) != int(r.get("competitor_price") or 0)]
+
+    def record(self, rows: list[dict], t: float | None = None) -> int:
+        """Append a change point for every row whose price moved; returns how many."""
+        t = int(t if t is not None else time.time())
+        new_keys, points = [], []
+        for row in rows:
+            key = self._key(row)
+            price = int(row.get("competitor_price") or 0)
+            sid = self._ids.get(key)
+            if sid is None:
+                sid = self._register(key)
+                new_keys.append(key)
+                self._last_t = np.append(self._last_t, 0)
+                self._last_price = np.append(self._last_price, -1)
+            previous = int(self._last_price[sid])
+            if previous == price:
+                continue
+            ts = max(t, int(self._last_t[sid]))
+            points.append((sid, ts - self._last_t[sid], price - max(previous, 0)))
+            self._last_t[sid], self._last_price[sid] = ts, price
+
+        if new_keys:
+            # Keys land before the points that reference them.
+            with open(self._keys_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(k, ensure_ascii=False) + "\n" for k in new_keys)
+            self.stats["new_series"] += len(new_keys)
+        if points:
+            block = np.array(points, dtype=POINT_DTYPE)
+            with open(self._points_path, "ab") as f:
+                block.tofile(f)
+            self._raw = np.concatenate([self._raw, block])
+            self._stale = True
+            self.stats["recorded"] += len(points)
+        return len(points)
+
+    # ── queries ──────────────────────────────────────────────────────────────
+    def _series_for(self, product_slug: str | None) -> np.ndarray:
+        ids = range(len(self.keys)) if product_slug is None else self._by_product.get(product_slug, [])
+        return np.fromiter(ids, dtype=np.int64)
+
+    def _rows(self, ids: np.ndarray, prices: np.ndarray, since: np.ndarray) -> list[dict]:
+        return [
+            {"product_slug": self.keys[s][0], "competitor_name": self.keys[s][1],
+             "competitor_price": int(p), "since": int(ts)}
+            for s, p, ts in zip(ids.tolist(), prices.tolist(), since.tolist())
+        ]
+
+    def latest(self, product_slug: str | None = None) -> list[dict]:
+        """Current price of every seller (of one product, or of all)."""
+        ids = self._series_for(product_slug)
+        ids = ids[self._last_price[ids] >= 0]
+        return self._rows(ids, self._last_price[ids], self._last_t[ids])
+
+    def price_at(self, t: float, product_slug: str | None = None) -> list[dict]:
+        """Price of every seller as of time `t`; sellers first seen after `t` are omitted."""
+        series, times, prices = self._columns()
+        ids = self._series_for(product_slug)
+        if not len(series) or not len(ids):
+            return []
+        # (series, t) packed into one sorted key: one searchsorted for all sellers.
+        packed = (series << 32) | times
+        idx = np.searchsorted(packed, (ids << 32) | int(t), side="right") - 1
+        found = (idx >= 0) & (series[np.maximum(idx, 0)] == ids)
+        idx = idx[found]
+        return self._rows(ids[found], prices[idx], times[idx])
+
+    def history(self, product_slug: str, competitor_name: str) -> list[tuple[int, int]]:
+        """(timestamp, price) change points of one seller, oldest first."""
+        sid = self._ids.get((product_slug, competitor_name))
+        if sid is None:
+            return []
+        series, times, prices = self._columns()
+        lo, hi = np.searchsorted(series, [sid, sid + 1])
+        return list(zip(times[lo:hi].tolist(), prices[lo:hi].tolist()))
@@ -0,0 +1,199 @@
+# pricing_engine.py
+
+import os
+import time
+
+import numpy as np
+from supabase import create_client
+
+from price_history import PriceHistory
+from storage import data_path
+from supplier_ingest.catalog import iter_rows
+
+# ─── CONFIG ────────────────────────────────────────────────────────────────────
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+MIN_MARGIN     = float(os.getenv("PRICING_MIN_MARGIN", "0.10"))      # over supplier cost, never below
+DEFAULT_MARKUP = float(os.getenv("PRICING_DEFAULT_MARKUP", "0.25"))  # cost-only products
+UNDERCUT       = float(os.getenv("PRICING_UNDERCUT", "1000"))        # toman below the cheapest competitor
+ROUND_TO       = float(os.getenv("PRICING_ROUND_TO", "1000"))
+OWN_SHOP       = os.getenv("PRICING_OWN_SHOP", "ویرا")              # our own Torob listing isn't a competitor
+BATCH_SIZE     = int(os.getenv("PRICING_BATCH_SIZE", "500"))
+# Competitor prices come from the crawler's local price history when it is
+# available (same WIRAAI_DATA_DIR), else from Supabase.
+USE_HISTORY    = os.getenv("PRICING_USE_HISTORY", "1") == "1"
+
+
+class Snapshot:
+    """
+    Everything pricing needs, as flat columns aligned on product rows:
+    `price` (ours), `competitor_min` / `competitor_count` and `supplier_cost`
+    (NaN where unknown). Built once per run from three bulk reads.
+    """
+
+    def __init__(self, products: list[dict], competitors: list[dict], offers: list[dict]):
+        self.ids = [p["id"] for p in products]
+        self.slugs = [p["product_slug"] for p in products]
+        self.price = np.array([p.get("price") or 0 for p in products], dtype=np.float64)
+        n = len(products)
+
+        by_slug = {slug: i for i, slug in enumerate(self.slugs)}
+        rows = [(by_slug.get(c["product_slug"], -1), c.get("competitor_price") or 0) for c in competitors
+                if OWN_SHOP not in (c.get("competitor_name") or "")]
+        idx, prices = _columns(rows)
+        keep = (idx >= 0) & (prices > 0)
+        self.competitor_min = np.full(n, np.inf)
+        np.minimum.at(self.competitor_min, idx[keep], prices[keep])
+        self.competitor_count = np.bincount(idx[keep], minlength=n)
+        self.competitor_min[self.competitor_count == 0] = np.nan
+
+        by_id = {pid: i for i, pid in enumerate(self.ids)}
+        idx, costs = _columns([(by_id.get(o["product_id"], -1), o.get("price") or 0) for o in offers])
+        keep = (idx >= 0) & (costs > 0)
+        self.supplier_cost = np.full(n, np.inf)
+        np.minimum.at(self.supplier_cost, idx[keep], costs[keep])
+        self.supplier_cost[np.isinf(self.supplier_cost)] = np.nan
+
+
+def _columns(pairs: list[tuple]) -> tuple[np.ndarray, np.ndarray]:
+    if not pairs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    idx, values = zip(*pairs)
+    return np.array(idx, dtype=np.int64), np.array(values, dtype=np.float64)
+
+
+def recommend(snap: Snapshot) -> dict[str, np.ndarray]:
+    """
+    Recommended price for every product at once:
+
+      * competitors known → undercut the cheapest by UNDERCUT
+      * cost only         → cost × (1 + DEFAULT_MARKUP)
+      * neither           → no recommendation (NaN)
+
+    never below cost × (1 + MIN_MARGIN), rounded to ROUND_TO (up when the
+    margin floor binds). `recommend_stock` flags products a supplier can
+    deliver with at least MIN_MARGIN under the cheapest competitor.
+    """
+    cost, market = snap.supplier_cost, snap.competitor_min
+    floor = cost * (1 + MIN_MARGIN)                                  # NaN without cost
+    target = np.where(np.isnan(market), cost * (1 + DEFAULT_MARKUP), market - UNDERCUT)
+    price = np.fmax(target, floor)                                   # fmax ignores NaN floors
+
+    rounded = np.round(price / ROUND_TO) * ROUND_TO
+    below = rounded < floor
+    rounded[below] = np.ceil(floor[below] / ROUND_TO) * ROUND_TO
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        margin = (rounded - cost) / cost                             # same basis as MIN_MARGIN
+    return {
+        "recommended_price": rounded,
+        "margin": margin,
+        "recommend_stock": ~np.isnan(cost) & ~np.isnan(market) & (market >= floor),
+    }
+
+
+class RecommendationState:
+    """Last emitted recommendation per product id, so unchanged rows aren't re-written."""
+
+    def __init__(self, path: str | None = None):
+        self.path = path or data_path("pricing_state.npz")
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        data = np.load(self.path, allow_pickle=False)
+        return dict(zip(data["ids"].tolist(), zip(data["price"].tolist(), data["stock"].tolist())))
+
+    def save(self, state: dict):
+        ids = list(state)
+        values = list(state.values())
+        np.savez(self.path,
+                 ids=np.array([str(i) for i in ids]),
+                 price=np.array([v[0] for v in values], dtype=np.float64),
+                 stock=np.array([v[1] for v in values], dtype=bool))
+
+
+def changed_rows(snap: Snapshot, rec: dict, previous: dict) -> tuple[np.ndarray, dict]:
+    """Row positions whose recommendation differs from `previous`, and the new state."""
+    ids = [str(i) for i in snap.ids]
+    old_price = np.array([previous.get(i, (np.nan, False))[0] for i in ids], dtype=np.float64)
+    old_stock = np.array([previous.get(i, (np.nan, False))[1] for i in ids], dtype=bool)
+    new_price, new_stock = rec["recommended_price"], rec["recommend_stock"]
+
+    both_nan = np.isnan(old_price) & np.isnan(new_price)
+    changed = ~both_nan & ((old_price != new_price) | (old_stock != new_stock))
+    state = {i: (p, s) for i, p, s in zip(ids, new_price.tolist(), new_stock.tolist()) if p == p}
+    return np.flatnonzero(changed), state
+
+
+def load_supplier_costs(sb) -> list[dict]:
+    """
+    Approved supplier offers with the catalog product they were matched to and
+    their price. This needs two supplier_queue columns that ingest and the
+    matcher don't fill in yet, set when a reviewer approves an offer:
+
+        product_id   products.id the offer was approved against
+        price        supplier cost in toman (numeric)
+
+    Until then the select fails and pricing runs on competitor prices alone.
+    """
+    try:
+        return list(iter_rows(
+            sb, "supplier_queue", "id,product_id,price",
+            filters=lambda q: q.eq("status", "approved"),
+        ))
+    except Exception as e:
+        print(f"[WARN] No supplier costs, pricing on competitors only: {e}")
+        return []
+
+
+def load_snapshot(sb) -> Snapshot:
+    products = list(iter_rows(sb, "products", "id,product_slug,price"))
+    history = PriceHistory() if USE_HISTORY else None
+    competitors = history.latest() if history is not None and history.keys else list(iter_rows(
+        sb, "competitor_prices", "id,product_slug,competitor_name,competitor_price"
+    ))
+    offers = load_supplier_costs(sb)
+    print(f"[PRICING] {len(products)} products, {len(competitors)} competitor prices, "
+          f"{len(offers)} supplier offers")
+    return Snapshot(products, competitors, offers)
+
+
+def main():
+    sb = create_client(SUPABASE_URL, SUPABASE_KEY)
+    start = time.perf_counter()
+    snap = load_snapshot(sb)
+    loaded = time.perf_counter()
+    rec = recommend(snap)
+    state_store = RecommendationState()
+    rows, state = changed_rows(snap, rec, state_store.load())
+    computed = time.perf_counter()
+
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    out = [{
+        "product_id":       snap.ids[i],
+        "product_slug":     snap.slugs[i],
+        "current_price":    float(snap.price[i]),
+        "recommended_price": None if np.isnan(rec["recommended_price"][i]) else float(rec["recommended_price"][i]),
+        "competitor_min":   None if np.isnan(snap.competitor_min[i]) else float(snap.competitor_min[i]),
+        "supplier_cost":    None if np.isnan(snap.supplier_cost[i]) else float(snap.supplier_cost[i]),
+        "margin":           None if np.isnan(rec["margin"][i]) else round(float(rec["margin"][i]), 4),
+        "recommend_stock":  bool(rec["recommend_stock"][i]),
+        "computed_at":      now,
+    } for i in rows.tolist()]
+
+    for i in range(0, len(out), BATCH_SIZE):
+        sb.table("price_recommendations") \
+          .upsert(out[i:i + BATCH_SIZE], on_conflict="product_id") \
+          .execute()
+    # Only remember what actually reached Supabase.
+    state_store.save(state)
+
+    print(f"[PRICING] {len(out)} of {len(snap.ids)} recommendations changed "
+          f"(load {loaded - start:.2f}s, compute {computed - loaded:.3f}s, "
+          f"{int(rec['recommend_stock'].sum())} to stock)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,96 @@
+import asyncio
+import os
 
-import requests
-from bs4 import BeautifulSoup
+import aiohttp
 
-BASE_URL = "https://wiraa.ir"
-
-def get_product_links(category_url, max_pages=2):
-    links = []
-    for page in range(1, max_pages + 1):
-        url = f"{category_url}?page={page}"
-        print(f"📄 Fetching: {url}")
-        response = requests.get(url)
-        if response.status_code != 200:
-            break
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        cards = soup.select("a.product-card__link")
-
-        for card in cards:
-            href = card.get("href")
-            if href:
-                full_url = BASE_URL + href
-                links.append(full_url)
-
-    return links
-
-
-if __name__ == "__main__":
-    category_url = "https://wiraa.ir/category/آرایشی-و-بهداشتی"
-    product_links = get_product_links(category_url)
-    print(f"✅ Found {len(product_links)} products")
-    for link in product_links:
-        print(link)
-
-import requests
-from bs4 import BeautifulSoup
+from page_extraction import ParsedPage
 
 BASE_URL = "https://wiraa.ir"
-
-def get_product_links(category_url, max_pages=2):
-    links = []
-    for page in range(1, max_pages + 1):
-        url = f"{category_url}?page={page}"
-        print(f"📄 Fetching: {url}")
-        response = requests.get(url)
-        if response.status_code != 200:
-            break
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        cards = soup.select("a.product-card__link")
-
-        for card in cards:
-            href = card.get("href")
-            if href:
-                full_url = BASE_URL + href
-                links.append(full_url)
-
-    return links
+# Hard stop for one category, in case a site never runs out of pages.
+MAX_PAGES = int(os.getenv("SCRAPER_MAX_PAGES", "200"))
+
+
+async def fetch_page(session: aiohttp.ClientSession, category_url: str, page: int) -> ParsedPage | None:
+    url = f"{category_url}?page={page}"
+    print(f"📄 Fetching: {url}")
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None
+            html = await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"⚠️ {url} failed: {e}")
+        return None
+    return await asyncio.to_thread(ParsedPage, html)
+
+
+async def iter_product_links(category_url, concurrency=8, max_pages=MAX_PAGES, session=None):
+    """
+    Async generator over every product URL in a category.
+
+    Page 1 is fetched first to discover the last page from its pagination
+    links; later pages are then fetched over one pooled session through a
+    sliding window of `concurrency` requests (a new page starts as each one
+    finishes) and links are yielded as soon as each page arrives. A page at or
+    past the last one that brings no new links ends the traversal (sites often
+    answer an out-of-range page with the last page or page 1), as does
+    `max_pages`; pass None to lift that cap.
+    """
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+    try:
+        seen = set()
+        first = await fetch_page(session, category_url, 1)
+        if first is None:
+            return
+        links = first.product_card_links(BASE_URL)
+        for link in links:
+            seen.add(link)
+            yield link
+        if not links:
+            return
+
+        # The discovered last page is only a hint: pagination widgets often show
+        # just a few neighbours, so probing continues past it until a page adds nothing.
+        last = first.last_page()
+        next_page = 2
+        pending: dict[asyncio.Task, int] = {}
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < concurrency and (max_pages is None or next_page <= max_pages):
+                    pending[asyncio.create_task(fetch_page(session, category_url, next_page))] = next_page
+                    next_page += 1
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page = pending.pop(task)
+                    parsed = task.result()
+                    page_links = parsed.product_card_links(BASE_URL) if parsed else []
+                    new_links = [link for link in dict.fromkeys(page_links) if link not in seen]
+                    if not new_links:
+                        exhausted = exhausted or page >= last
+                        continue
+                    seen.update(new_links)
+                    for link in new_links:
+                        yield link
+        finally:
+            for task in pending:
+                task.cancel()
+    finally:
+        if own_session:
+            await session.close()
+
+
+def get_product_links(category_url, max_pages=MAX_PAGES):
+    async def collect():
+        return [link async for link in iter_product_links(category_url, max_pages=max_pages)]
+    return asyncio.run(collect())
 
 
 if __name__ == "__main__":
@@ -63,4 +98,4 @@ if __name__ == "__main__":
     product_links = get_product_links(category_url)
     print(f"✅ Found {len(product_links)} products")
     for link in product_links:
-        print(link)
\ No newline at end of file
+        print(link)
@@ -0,0 +1,136 @@
+# ranking.py
+
+import heapq
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+
+class TopK:
+    """
+    The `k` highest-scored entries seen so far, in a bounded min-heap: pushing
+    n candidates costs O(n log k) and O(k) memory instead of a full sort.
+    Ties keep the earlier entry, like a stable descending sort would.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap: list[tuple] = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def threshold(self) -> float:
+        """Score an entry must beat to get in (-inf until the heap is full)."""
+        return self._heap[0][0] if len(self._heap) >= self.k else float("-inf")
+
+    def push(self, score: float, entry) -> bool:
+        item = (score, -self._seq, entry)
+        self._seq += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+            return True
+        if item[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, item)
+            return True
+        return False
+
+    def items(self) -> list:
+        """Entries, best first."""
+        return [entry for *_, entry in sorted(self._heap, key=lambda x: x[:2], reverse=True)]
+
+
+class Ranking:
+    """One product's candidates, fed in one or more batches (e.g. result pages)."""
+
+    def __init__(self, ranker: "CandidateRanker", query: str):
+        self.ranker = ranker
+        self.query = query
+        self.top = TopK(ranker.k)
+        self.seen = 0
+        self.semantic_skipped = 0
+        self.elapsed = 0.0
+
+    @property
+    def best(self) -> float:
+        ranked = self.top.items()
+        return ranked[0][0] if ranked else float("-inf")
+
+    def add(self, candidates: list[dict]) -> "Ranking":
+        start = time.perf_counter()
+        names = [item.get(self.ranker.name_key, "") for item in candidates]
+        fuzzy = [self.ranker.fuzzy(name, self.query) for name in names]
+
+        # Already past the review threshold on fuzzy alone: the semantic score
+        # can't change the decision, so those names are never encoded.
+        need = [i for i, f in enumerate(fuzzy) if f < self.ranker.accept]
+        semantic = [-1.0] * len(names)
+        if need:
+            for i, s in zip(need, self.ranker.semantic(self.query, [names[i] for i in need])):
+                semantic[i] = s
+        self.semantic_skipped += len(names) - len(need)
+
+        for item, f, s in zip(candidates, fuzzy, semantic):
+            final = f if s < 0 else max(f, s)
+            self.top.push(final, (final, f, s, item))
+        self.seen += len(candidates)
+        self.elapsed += time.perf_counter() - start
+        return self
+
+    def results(self) -> list[tuple]:
+        """(final, fuzzy, semantic, item) tuples, best first; records the timing."""
+        self.ranker._record(self)
+        return self.top.items()
+
+
+class CandidateRanker:
+    """
+    Scores Torob candidates against a product name and keeps the top `k`.
+
+    `fuzzy(name, query)` is computed for every candidate; `semantic(query,
+    names)` only for those whose fuzzy score is below `accept` (the review
+    threshold), in one batch per call to `add`. Per-product ranking time goes
+    to `timings`; `summary()` reports counts and p50/p95/max.
+
+        ranking = ranker.start(product_name)
+        ranking.add(page0_results).add(page1_results)
+        top_five = ranking.results()
+    """
+
+    def __init__(self, fuzzy: Callable[[str, str], float],
+                 semantic: Callable[[str, list[str]], list[float]],
+                 k: int = 5, accept: float = 0.8, name_key: str = "name1"):
+        self.fuzzy = fuzzy
+        self.semantic = semantic
+        self.k = k
+        self.accept = accept
+        self.name_key = name_key
+        self.stats = {"products": 0, "candidates": 0, "semantic_skipped": 0}
+        self.timings: list[float] = []
+        self._lock = threading.Lock()   # rankings finish on worker threads
+
+    def start(self, query: str) -> Ranking:
+        return Ranking(self, query)
+
+    def rank(self, query: str, candidates: list[dict]) -> list[tuple]:
+        return self.start(query).add(candidates).results()
+
+    def _record(self, ranking: Ranking):
+        with self._lock:
+            self.stats["products"] += 1
+            self.stats["candidates"] += ranking.seen
+            self.stats["semantic_skipped"] += ranking.semantic_skipped
+            self.timings.append(ranking.elapsed)
+
+    def summary(self) -> dict:
+        t = np.asarray(self.timings) * 1000 if self.timings else np.zeros(1)
+        return {
+            **self.stats,
+            "p50_ms": round(float(np.percentile(t, 50)), 2),
+            "p95_ms": round(float(np.percentile(t, 95)), 2),
+            "max_ms": round(float(t.max()), 2),
+        }
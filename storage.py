@@ -0,0 +1,22 @@
+# storage.py
+
+import os
+from functools import lru_cache
+from pathlib import Path
+
+
+@lru_cache()
+def get_data_dir() -> str:
+    """
+    Local folder for caches and state that should survive between runs
+    (override the parent with WIRAAI_DATA_DIR, e.g. a cached CI directory).
+    """
+    folder = os.path.join(os.getenv("WIRAAI_DATA_DIR", Path.home()), ".wiraai")
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def data_path(*parts: str) -> str:
+    path = os.path.join(get_data_dir(), *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,144 @@
+# supabase_writer.py
+
+import asyncio
+import time
+from itertools import count
+
+from supabase import Client
+
+
+class BatchWriter:
+    """
+    Buffered writer that turns many single-row Supabase writes into bulk requests.
+
+    Rows are accumulated per (table, on_conflict) and flushed when any buffer
+    reaches `batch_size` rows or `flush_interval` seconds have passed. Tables are
+    flushed in the order they were first written to, so parent rows (products)
+    always land before the rows that reference them (competitor_prices).
+
+        async with BatchWriter(supabase) as writer:
+            await writer.upsert("products", row, on_conflict="url", group=row["url"])
+            writer.mark(row["url"], group=row["url"])
+
+    Tokens passed to `mark()` are handed to `on_flush` once the rows written
+    under the same `group` are in the database, so callers can checkpoint only
+    what actually landed. A group's rows may go out over several flushes (a
+    size-triggered flush, another worker's flush); if any of those batches
+    failed, the token is dropped and the group's later rows (e.g. competitor
+    prices of a product that didn't land) aren't written. Tokens without a
+    group are only confirmed while no ungrouped row has failed.
+    """
+
+    def __init__(self, client: Client, batch_size: int = 200, flush_interval: float = 5.0,
+                 max_retries: int = 3, retry_delay: float = 1.0, on_flush=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.on_flush = on_flush
+        self.stats = {"rows": 0, "batches": 0, "failed_rows": 0, "dropped_tokens": 0}
+        # (table, on_conflict) → {dedupe key: (row, groups)}; dict order doubles as flush order
+        self._buffers: dict[tuple[str, str | None], dict] = {}
+        self._tokens: list[tuple] = []   # (token, group)
+        self._failed_groups: set = set()   # groups with a row in a batch that gave up
+        self._seq = count()
+        self._lock = asyncio.Lock()
+        self._last_flush = time.monotonic()
+        self._timer: asyncio.Task | None = None
+
+    async def __aenter__(self):
+        self._timer = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._timer:
+            # Cancel under the lock so a periodic flush is never interrupted
+            # between swapping out the buffers and writing them.
+            async with self._lock:
+                self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+        await self.flush()
+
+    async def upsert(self, table: str, row: dict, on_conflict: str, group=None):
+        # Postgres rejects a bulk upsert that touches the same key twice, so a
+        # later row for the same conflict key replaces the buffered one.
+        key = tuple(row.get(col.strip()) for col in on_conflict.split(","))
+        await self._add((table, on_conflict), key, row, group)
+
+    async def insert(self, table: str, row: dict, group=None):
+        await self._add((table, None), next(self._seq), row, group)
+
+    def mark(self, token, group=None):
+        self._tokens.append((token, group))
+
+    async def _add(self, buffer_key: tuple, row_key, row: dict, group):
+        buf = self._buffers.setdefault(buffer_key, {})
+        # A replaced row's group now depends on the row that replaced it.
+        _, groups = buf.get(row_key, (None, set()))
+        buf[row_key] = (row, groups | {group})
+        if len(buf) >= self.batch_size:
+            await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    # Keep the timer alive; the next flush picks up new rows.
+                    print(f"[ERROR] Periodic flush failed: {e}")
+
+    async def flush(self):
+        async with self._lock:
+            buffers, self._buffers = self._buffers, {}
+            tokens, self._tokens = self._tokens, []
+            self._last_flush = time.monotonic()
+            for (table, on_conflict), entries in buffers.items():
+                # Rows of a group that already lost a batch (e.g. its parent
+                # product row) aren't written; the group is redone anyway.
+                entries = [(row, groups) for row, groups in entries.values()
+                           if None in groups or not groups <= self._failed_groups]
+                if entries:
+                    rows = [row for row, _ in entries]
+                    if not await self._write_batch(table, on_conflict, rows):
+                        for _, groups in entries:
+                            self._failed_groups |= groups
+            # Every row of a marked group was added before its mark, so it was
+            # in this flush or an earlier one (flushes run under the lock).
+            confirmed = []
+            for token, group in tokens:
+                if group in self._failed_groups:
+                    self.stats["dropped_tokens"] += 1
+                else:
+                    confirmed.append(token)
+            self._failed_groups -= {group for _, group in tokens if group is not None}
+            if confirmed and self.on_flush is not None:
+                await self.on_flush(confirmed)
+
+    async def _write_batch(self, table: str, on_conflict: str | None, rows: list[dict]) -> bool:
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                resp = await asyncio.to_thread(self._execute, table, on_conflict, rows)
+                if resp.data is None:
+                    raise RuntimeError("Supabase returned no data")
+                self.stats["rows"] += len(rows)
+                self.stats["batches"] += 1
+                print(f"[DB] {table}: wrote {len(rows)} rows")
+                return True
+            except Exception as e:
+                print(f"[WARN] {table} batch of {len(rows)} failed (attempt {attempt}/{self.max_retries}): {e}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+        self.stats["failed_rows"] += len(rows)
+        print(f"[ERROR] Giving up on {len(rows)} rows for {table}")
+        return False
+
+    def _execute(self, table: str, on_conflict: str | None, rows: list[dict]):
+        query = self.client.table(table)
+        if on_conflict:
+            return query.upsert(rows, on_conflict=on_conflict).execute()
+        return query.insert(rows).execute()
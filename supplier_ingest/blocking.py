@@ -0,0 +1,89 @@
+# supplier_ingest/blocking.py
+
+from collections import Counter, defaultdict
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from persian_text import normalize, tokens
+
+
+def name_keys(text: str, n: int = 3) -> set[str]:
+    """Blocking keys for a name: its whole tokens plus character n-grams of each token."""
+    keys = set()
+    for token in tokens(text):
+        keys.add("w:" + token)
+        padded = f" {token} "
+        for i in range(len(padded) - n + 1):
+            keys.add(padded[i:i + n])
+    return keys
+
+
+class BlockingIndex:
+    """
+    Inverted index from token / character n-gram keys to catalog rows.
+
+    `candidates(name)` returns the rows sharing the most keys with `name`, so
+    each offer is only scored against a short list instead of the whole
+    catalog. Keys that occur in more than `max_key_share` of the catalog
+    (e.g. a brand on every product) carry no signal and are ignored.
+    """
+
+    def __init__(self, names: list[str], max_candidates: int = 50, max_key_share: float = 0.2):
+        self.names = names
+        self.normalized = [normalize(n) for n in names]
+        self.max_candidates = max_candidates
+        postings = defaultdict(list)
+        for row, name in enumerate(names):
+            for key in name_keys(name):
+                postings[key].append(row)
+        # Small catalogs (e.g. just the products changed since the last run)
+        # have short postings anyway; only prune keys on real catalogs.
+        limit = max(self.max_candidates, int(len(names) * max_key_share))
+        self.postings = {k: v for k, v in postings.items() if len(v) <= limit}
+
+    def candidates(self, name: str) -> list[int]:
+        counts = Counter()
+        for key in name_keys(name):
+            rows = self.postings.get(key)
+            if rows:
+                counts.update(rows)
+        return [row for row, _ in counts.most_common(self.max_candidates)]
+
+
+def best_matches(index: BlockingIndex, queries: list[str], score_cutoff: int = 0,
+                 chunk_size: int = 512) -> list[tuple[int, float] | None]:
+    """
+    Best (catalog row, token_sort_ratio) per query, or None below `score_cutoff`.
+
+    Queries are processed in chunks: the union of the chunk's candidate rows is
+    scored against every query of the chunk in one multi-threaded
+    `process.cdist` call, then each query keeps the best score among its own
+    candidates.
+    """
+    results: list[tuple[int, float] | None] = []
+    for start in range(0, len(queries), chunk_size):
+        chunk = queries[start:start + chunk_size]
+        cand_lists = [index.candidates(q) for q in chunk]
+        union = sorted({row for rows in cand_lists for row in rows})
+        if not union:
+            results.extend([None] * len(chunk))
+            continue
+
+        column = {row: col for col, row in enumerate(union)}
+        scores = process.cdist(
+            [normalize(q) for q in chunk],
+            [index.normalized[row] for row in union],
+            scorer=fuzz.token_sort_ratio,
+            dtype=np.uint8,
+            workers=-1,
+        )
+        for i, rows in enumerate(cand_lists):
+            if not rows:
+                results.append(None)
+                continue
+            cols = np.fromiter((column[r] for r in rows), dtype=np.intp, count=len(rows))
+            j = int(np.argmax(scores[i, cols]))
+            score = float(scores[i, cols[j]])
+            results.append((rows[j], score) if score >= score_cutoff else None)
+    return results
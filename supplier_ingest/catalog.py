@@ -0,0 +1,183 @@
+# supplier_ingest/catalog.py
+
+import os
+import sqlite3
+
+from storage import data_path
+
+PAGE_SIZE = int(os.getenv("MATCHER_PAGE_SIZE", "1000"))
+PRODUCT_COLUMNS = ("id", "product_slug", "name", "updated_at")
+
+
+def iter_rows(sb, table: str, columns: str, filters=None, key: str = "id", page_size: int = PAGE_SIZE):
+    """
+    Yield every row of `table` page by page using keyset pagination on `key`.
+
+    Each page asks for `key > last key seen`, so pages stay cheap however deep
+    we go (no OFFSET scans) and rows inserted mid-scan can't shift the window.
+    `filters(query)` may add extra conditions (eq, gte, ...).
+    """
+    last = None
+    while True:
+        query = sb.table(table).select(columns)
+        if filters is not None:
+            query = filters(query)
+        if last is not None:
+            query = query.gt(key, last)
+        rows = query.order(key).limit(page_size).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1][key]
+
+
+class CatalogSnapshot:
+    """
+    On-disk copy of the `products` columns the matcher needs.
+
+    `sync()` only transfers rows whose `updated_at` is at or after the stored
+    watermark, so a nightly run downloads the day's changes rather than the
+    whole catalog. Nothing in the database maintains `updated_at`: the
+    crawler's product upsert sets it, and any other writer to `products` must
+    too or its rows won't reach the snapshot. Set `full=True` (MATCHER_FULL_SYNC=1) to rebuild from
+    scratch, e.g. to drop products deleted upstream.
+
+    Every sync that adds or renames products bumps the catalog `version` and
+    stamps those rows with it (`name_version`), so the matcher can score
+    offers against only the products that changed since it last saw them
+    (see `match_states`).
+    """
+
+    def __init__(self, path: str | None = None):
+        self.conn = sqlite3.connect(path or data_path("catalog.db"))
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS products (
+                id PRIMARY KEY,
+                product_slug TEXT,
+                name TEXT,
+                updated_at TEXT,
+                name_version INTEGER DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS offer_matches (
+                offer_id PRIMARY KEY,
+                offer_name TEXT,
+                version INTEGER,
+                product_id,
+                final REAL,
+                fuzzy REAL,
+                semantic REAL
+            );
+            """
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(products)")}
+        if "name_version" not in columns:   # snapshot from before versioning
+            self.conn.execute("ALTER TABLE products ADD COLUMN name_version INTEGER DEFAULT 0")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _meta(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def watermark(self) -> str | None:
+        return self._meta("watermark")
+
+    @property
+    def version(self) -> int:
+        return int(self._meta("version") or 0)
+
+    def sync(self, sb, full: bool = False) -> int:
+        """Pull new/changed products into the snapshot; returns how many rows changed."""
+        watermark = None if full else self.watermark
+        # >= rather than >: rows sharing the watermark timestamp may have
+        # landed after the previous sync read it. Re-reading them is harmless.
+        filters = (lambda q: q.gte("updated_at", watermark)) if watermark else None
+
+        changed = 0
+        newest = watermark
+        version = self.version + 1
+        batch = []
+        with self.conn:
+            if full:
+                self.conn.execute("DELETE FROM products")
+            for row in iter_rows(sb, "products", ", ".join(PRODUCT_COLUMNS), filters=filters):
+                batch.append(tuple(row.get(col) for col in PRODUCT_COLUMNS) + (version,))
+                if row.get("updated_at") and (newest is None or row["updated_at"] > newest):
+                    newest = row["updated_at"]
+                if len(batch) >= PAGE_SIZE:
+                    changed += self._upsert(batch)
+                    batch = []
+            changed += self._upsert(batch)
+            if newest:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)", (newest,)
+                )
+            renamed = self.conn.execute(
+                "SELECT COUNT(*) FROM products WHERE name_version = ?", (version,)
+            ).fetchone()[0]
+            if renamed:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(version),)
+                )
+        return changed
+
+    def _upsert(self, rows: list[tuple]) -> int:
+        # name_version only moves when the product is new or its name changed;
+        # price/stock edits touch updated_at but mustn't trigger re-matching.
+        if rows:
+            self.conn.executemany(
+                """
+                INSERT INTO products (id, product_slug, name, updated_at, name_version)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    product_slug = excluded.product_slug,
+                    updated_at = excluded.updated_at,
+                    name_version = CASE WHEN products.name IS excluded.name
+                                        THEN products.name_version ELSE excluded.name_version END,
+                    name = excluded.name
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def products(self) -> list[dict]:
+        cursor = self.conn.execute("SELECT id, product_slug, name, name_version FROM products ORDER BY id")
+        return [{"id": r[0], "product_slug": r[1], "name": r[2], "name_version": r[3]} for r in cursor]
+
+    # ── matcher state ────────────────────────────────────────────────────────
+    def match_states(self) -> dict:
+        """offer id → best match found so far and the catalog version it covers."""
+        cursor = self.conn.execute(
+            "SELECT offer_id, offer_name, version, product_id, final, fuzzy, semantic FROM offer_matches"
+        )
+        return {
+            r[0]: {"offer_name": r[1], "version": r[2], "product_id": r[3],
+                   "final": r[4], "fuzzy": r[5], "semantic": r[6]}
+            for r in cursor
+        }
+
+    def save_match_states(self, states: dict):
+        """Replace the stored state; offers no longer pending simply drop out."""
+        with self.conn:
+            self.conn.execute("DELETE FROM offer_matches")
+            self.conn.executemany(
+                """
+                INSERT INTO offer_matches (offer_id, offer_name, version, product_id, final, fuzzy, semantic)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(oid, s["offer_name"], s["version"], s["product_id"], s["final"], s["fuzzy"], s["semantic"])
+                 for oid, s in states.items()],
+            )
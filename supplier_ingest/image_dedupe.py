@@ -0,0 +1,121 @@
+# supplier_ingest/image_dedupe.py
+
+import sqlite3
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from storage import data_path
+
+
+def dhash(data: bytes, size: int = 8) -> int:
+    """64-bit difference hash: survives re-compression and resizing of a forwarded photo."""
+    img = Image.open(BytesIO(data)).convert("L").resize((size + 1, size), Image.LANCZOS)
+    px = np.asarray(img, dtype=np.int16)
+    bits = (px[:, 1:] > px[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class ImageFingerprintCache:
+    """
+    Remembers the OCR text of every supplier photo we've processed.
+
+    Lookups go from cheapest to most expensive: Telegram's `file_unique_id`
+    (same file, no download needed), then a perceptual hash within
+    `max_distance` bits (same picture, re-sent or re-compressed). `mark_queued`
+    claims a (supplier, name) pair for an image before it is put on
+    supplier_queue, so a re-forwarded photo with the same caption doesn't
+    create a second row for that supplier; `unmark_queued` releases the claim
+    if the insert fails.
+
+        hit = cache.find(file_unique_id)
+        if hit is None:
+            phash = dhash(data)
+            hit = cache.find_similar(phash) or (phash, run_ocr(data))
+            cache.add(file_unique_id, *hit)
+    """
+
+    def __init__(self, path: str | None = None, max_distance: int = 4):
+        self.max_distance = max_distance
+        self.conn = sqlite3.connect(path or data_path("image_fingerprints.db"))
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                file_unique_id TEXT PRIMARY KEY,
+                phash TEXT,
+                ocr_text TEXT,
+                created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS queued_offers (
+                phash TEXT,
+                supplier TEXT,
+                name TEXT,
+                PRIMARY KEY (phash, supplier, name)
+            );
+            -- Superseded: keyed without the supplier, so a second supplier
+            -- forwarding the same picture and caption was dropped.
+            DROP TABLE IF EXISTS queued;
+            """
+        )
+        self.stats = {"id_hits": 0, "hash_hits": 0, "misses": 0, "skipped_rows": 0}
+        # Distinct hashes kept in memory for the vectorised Hamming-distance scan.
+        self._hashes: dict[int, str] = {}
+        for phash, text in self.conn.execute("SELECT phash, ocr_text FROM images"):
+            self._hashes.setdefault(int(phash, 16), text)
+        self._matrix = np.fromiter(self._hashes, dtype=np.uint64, count=len(self._hashes))
+
+    def close(self):
+        self.conn.close()
+
+    def find(self, file_unique_id: str) -> tuple[int, str] | None:
+        row = self.conn.execute(
+            "SELECT phash, ocr_text FROM images WHERE file_unique_id = ?", (file_unique_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.stats["id_hits"] += 1
+        return int(row[0], 16), row[1]
+
+    def find_similar(self, phash: int) -> tuple[int, str] | None:
+        """Closest known image within `max_distance` bits, as (its hash, its OCR text)."""
+        if len(self._matrix):
+            xor = self._matrix ^ np.uint64(phash)
+            dist = np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+            best = int(np.argmin(dist))
+            if dist[best] <= self.max_distance:
+                self.stats["hash_hits"] += 1
+                match = int(self._matrix[best])
+                return match, self._hashes[match]
+        self.stats["misses"] += 1
+        return None
+
+    def add(self, file_unique_id: str, phash: int, ocr_text: str):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images (file_unique_id, phash, ocr_text, created_at) VALUES (?, ?, ?, ?)",
+                (file_unique_id, f"{phash:016x}", ocr_text, time.time()),
+            )
+        if phash not in self._hashes:
+            self._hashes[phash] = ocr_text
+            self._matrix = np.append(self._matrix, np.uint64(phash))
+
+    def mark_queued(self, phash: int, supplier: str, name: str) -> bool:
+        """Record `name` from `supplier` as queued for this image; False if it already was."""
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO queued_offers (phash, supplier, name) VALUES (?, ?, ?)",
+                (f"{phash:016x}", supplier, name),
+            )
+        if cursor.rowcount == 0:
+            self.stats["skipped_rows"] += 1
+            return False
+        return True
+
+    def unmark_queued(self, phash: int, supplier: str, name: str):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM queued_offers WHERE phash = ? AND supplier = ? AND name = ?",
+                (f"{phash:016x}", supplier, name),
+            )
@@ -1,12 +1,23 @@
 # supplier_ingest/ingest.py
 
 import os
+import sys
+import signal
+import asyncio
 import logging
-import requests
-import tempfile
+from collections import deque
 from uuid import uuid4
+
+import aiohttp
 from supabase import create_client, Client
 
+# Run as a script: this directory is on sys.path, the repo root (storage,
+# persian_text, pipeline) is not.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_dedupe import ImageFingerprintCache, dhash  # noqa: E402
+from persian_text import clean  # noqa: E402
+from pipeline import DONE, run_stage  # noqa: E402
+
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
 # ─── ENV & CLIENTS ────────────────────────────────────────────────────────────
@@ -23,21 +34,33 @@ API = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}"
 
 HF_URL = "https://api-inference.huggingface.co/pipeline/vision-to-text/Salesforce/blip2-flan-t5-base"
 HF_HEADERS = {"Authorization": f"Bearer {HF_TOKEN}"}
+SUPPLIER   = "Telegram"   # supplier_queue.supplier for offers from this poller
+
+# ─── PIPELINE CONFIG ───────────────────────────────────────────────────────────
+DOWNLOAD_WORKERS = int(os.getenv("INGEST_DOWNLOAD_WORKERS", "8"))
+OCR_WORKERS      = int(os.getenv("INGEST_OCR_WORKERS", "4"))
+QUEUE_SIZE       = int(os.getenv("INGEST_QUEUE_SIZE", "32"))
+# Daemon mode: keep long-polling instead of one getUpdates call per run.
+DAEMON           = os.getenv("INGEST_DAEMON", "0") == "1"
+POLL_TIMEOUT     = int(os.getenv("INGEST_POLL_TIMEOUT", "50"))
 
 # ─── HELPERS ───────────────────────────────────────────────────────────────────
-def hf_ocr(path: str) -> str:
-    """Caption the image via HF's BLIP2 vision-to-text."""
-    with open(path, "rb") as f:
-        data = f.read()
+async def hf_ocr(session: aiohttp.ClientSession, data: bytes) -> str | None:
+    """
+    Caption the image bytes via HF's BLIP2 vision-to-text. None when the call
+    fails (e.g. 503 while the model loads), so the miss isn't cached as "".
+    """
     try:
-        res = requests.post(HF_URL, headers=HF_HEADERS, data=data, timeout=60)
-        res.raise_for_status()
-        out = res.json()
+        async with session.post(HF_URL, headers=HF_HEADERS, data=data,
+                                timeout=aiohttp.ClientTimeout(total=60)) as res:
+            res.raise_for_status()
+            out = await res.json(content_type=None)
         if isinstance(out, list) and out:
             return out[0].get("generated_text", "").strip()
+        logging.warning("HF OCR returned no caption: %s", out)
     except Exception as e:
         logging.warning("HF OCR failed: %s", e)
-    return ""
+    return None
 
 def get_last_offset() -> int:
     r = sb.table("ingest_state") \
@@ -53,69 +76,219 @@ def set_last_offset(offset: int):
       .execute()
 
 def queue_supplier(image_url: str, caption: str, box_text: str):
-    full = (caption + " " + box_text).strip()
+    full = clean(caption + " " + box_text)
     sb.table("supplier_queue").insert({
         "id":             str(uuid4()),
         "image_url":      image_url,
         "raw_ocr_text":   box_text,
         "extracted_name": full,
-        "supplier":       "Telegram",
+        "supplier":       SUPPLIER,
         "status":         "pending"
     }).execute()
     logging.info("Queued offer: %s", full)
 
-# ─── MAIN POLLER ───────────────────────────────────────────────────────────────
-def handle_telegram():
-    last = get_last_offset()
-    try:
-        resp = requests.get(f"{API}/getUpdates",
-                            params={"offset": last+1, "timeout": 10}, timeout=30)
+# ─── PIPELINE ──────────────────────────────────────────────────────────────────
+class OffsetTracker:
+    """
+    Commits the Telegram offset once per getUpdates batch, after every photo
+    in it (and in all earlier batches) has been processed. The poller asks
+    Telegram for updates after `committed` too, never after what it has merely
+    handed out, since getUpdates confirms (and drops) everything below the
+    offset it is sent; so a crash never skips past work that was still in the
+    pipeline. `advanced` is set whenever the committed offset moves.
+    """
+
+    def __init__(self, committed: int):
+        self.committed = committed
+        self.advanced = asyncio.Event()
+        self._batches = deque()   # [max update_id, photos still in flight]
+        self._lock = asyncio.Lock()
+
+    def add_batch(self, max_id: int, photos: int) -> list:
+        batch = [max_id, photos]
+        self._batches.append(batch)
+        return batch
+
+    async def done(self, batch: list):
+        batch[1] -= 1
+        if batch[1] == 0:
+            await self.commit()
+
+    async def commit(self):
+        async with self._lock:
+            offset = self.committed
+            while self._batches and self._batches[0][1] <= 0:
+                offset = max(offset, self._batches.popleft()[0])
+            if offset != self.committed:
+                await asyncio.to_thread(set_last_offset, offset)
+                self.committed = offset
+                self.advanced.set()
+                logging.info("Updated last_offset → %d", offset)
+
+async def fetch_updates(session: aiohttp.ClientSession, last: int, timeout: int = 10) -> list[dict]:
+    async with session.get(f"{API}/getUpdates",
+                           params={"offset": last+1, "timeout": timeout},
+                           timeout=aiohttp.ClientTimeout(total=timeout+20)) as resp:
         resp.raise_for_status()
-        updates = resp.json().get("result", [])
-    except Exception as e:
-        logging.error("Failed fetchUpdates: %s", e)
+        return (await resp.json()).get("result", [])
+
+async def poll_updates(session: aiohttp.ClientSession, last: int, timeout: int,
+                       stop: asyncio.Event) -> list[dict] | None:
+    """fetch_updates that gives up (returning None) as soon as `stop` is set."""
+    poll = asyncio.create_task(fetch_updates(session, last, timeout))
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait({poll, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    stopped.cancel()
+    if not poll.done():
+        poll.cancel()
+        return None
+    return poll.result()
+
+async def wait_first(*aws):
+    """Wait until the first of `aws` finishes and cancel the rest."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in tasks:
+        task.cancel()
+
+async def download_photo(session: aiohttp.ClientSession, cache: ImageFingerprintCache, msg: dict) -> dict:
+    """
+    Resolve the largest photo size and download it into memory, unless its
+    file_unique_id is already cached (then only the file URL is resolved).
+    """
+    caption = msg.get("caption") or msg.get("text") or ""
+    photo = msg["photo"][-1]
+    unique_id = photo.get("file_unique_id") or photo["file_id"]
+    async with session.get(f"{API}/getFile", params={"file_id": photo["file_id"]},
+                           timeout=aiohttp.ClientTimeout(total=20)) as resp:
+        meta = await resp.json()
+    path = meta["result"]["file_path"]
+    url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{path}"
+
+    item = {"url": url, "caption": caption, "unique_id": unique_id, "cached": cache.find(unique_id)}
+    if item["cached"] is None:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as dl:
+            dl.raise_for_status()
+            item["data"] = await dl.read()
+    return item
+
+async def ocr_and_queue(session: aiohttp.ClientSession, cache: ImageFingerprintCache, photo: dict):
+    hit = photo["cached"]
+    if hit is None:
+        phash = await asyncio.to_thread(dhash, photo["data"])
+        hit = cache.find_similar(phash)
+        ocr_failed = False
+        if hit is None:
+            box_text = await hf_ocr(session, photo["data"])
+            ocr_failed = box_text is None
+            hit = (phash, box_text or "")
+        # A failed OCR isn't remembered, so the next copy gets another try.
+        if not ocr_failed:
+            cache.add(photo["unique_id"], *hit)
+
+    phash, box_text = hit
+    name = clean(photo["caption"] + " " + box_text)
+    if not cache.mark_queued(phash, SUPPLIER, name):
+        logging.info("Skipping duplicate photo %s", photo["unique_id"])
         return
+    try:
+        await asyncio.to_thread(queue_supplier, photo["url"], photo["caption"], box_text)
+    except Exception:
+        # Not on supplier_queue after all: let a re-forward queue it.
+        cache.unmark_queued(phash, SUPPLIER, name)
+        raise
+
+# ─── MAIN POLLER ───────────────────────────────────────────────────────────────
+async def handle_telegram(daemon: bool = DAEMON):
+    offsets = OffsetTracker(await asyncio.to_thread(get_last_offset))
+    # Both queues are bounded: when OCR falls behind, downloads stall and the
+    # poller blocks on put() instead of pulling more updates.
+    downloads: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    photos: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    stop = asyncio.Event()
+    if daemon:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+    # One pooled session for Telegram and HF; workers bound the concurrency.
+    connector = aiohttp.TCPConnector(limit=DOWNLOAD_WORKERS + OCR_WORKERS + 1)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        cache = ImageFingerprintCache()
+
+        async def download(item):
+            msg, batch = item
+            try:
+                return await download_photo(session, cache, msg), batch
+            except Exception:
+                await offsets.done(batch)
+                raise
+
+        async def ocr(item):
+            photo, batch = item
+            try:
+                await ocr_and_queue(session, cache, photo)
+            finally:
+                await offsets.done(batch)
+
+        stages = asyncio.gather(
+            run_stage(downloads, download, DOWNLOAD_WORKERS, outbox=photos, downstream=OCR_WORKERS),
+            run_stage(photos, ocr, OCR_WORKERS),
+        )
+
+        seen = offsets.committed   # highest update_id handed to the pipeline
+        while not stop.is_set():
+            offsets.advanced.clear()
+            try:
+                # From the committed offset, not `seen`: updates still in the
+                # pipeline must stay unconfirmed on Telegram's side.
+                updates = await poll_updates(session, offsets.committed, POLL_TIMEOUT if daemon else 10, stop)
+            except Exception as e:
+                logging.error("Failed fetchUpdates: %s", e)
+                if not daemon:
+                    break
+                await asyncio.sleep(5)
+                continue
+            if updates is None:
+                break
+
+            msgs = []
+            max_id = seen
+            fresh = 0
+            for u in updates:
+                uid = u.get("update_id", 0)
+                if uid <= seen:
+                    continue
+                max_id = max(max_id, uid)
+                fresh += 1
+
+                msg = u.get("message") or u.get("channel_post")
+                if msg and msg.get("photo"):
+                    msgs.append(msg)
+            if updates and not fresh:
+                # Only updates already in flight came back: wait for them to
+                # commit rather than re-polling them in a tight loop.
+                await wait_first(offsets.advanced.wait(), stop.wait())
+                continue
+            seen = max_id
+
+            if fresh:
+                logging.info("Processing %d photos from %d updates", len(msgs), fresh)
+            batch = offsets.add_batch(max_id, len(msgs))
+            for msg in msgs:
+                await downloads.put((msg, batch))
+            if not msgs:
+                await offsets.commit()
+            if not daemon:
+                break
 
-    max_id = last
-    for u in updates:
-        uid = u.get("update_id", 0)
-        if uid <= last:
-            continue
-        max_id = max(max_id, uid)
-
-        msg = u.get("message") or u.get("channel_post")
-        if not msg or not msg.get("photo"):
-            continue
-
-        caption = msg.get("caption") or msg.get("text") or ""
-        # download Telegram file_path
-        file_id = msg["photo"][-1]["file_id"]
-        try:
-            meta = requests.get(f"{API}/getFile",
-                                params={"file_id": file_id}, timeout=20).json()
-            path = meta["result"]["file_path"]
-        except Exception as e:
-            logging.error("getFile failed: %s", e)
-            continue
-
-        url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{path}"
-        # fetch to temp, run HF OCR
-        try:
-            dl = requests.get(url, stream=True, timeout=30); dl.raise_for_status()
-            with tempfile.NamedTemporaryFile(suffix=".jpg") as tmp:
-                for chunk in dl.iter_content(1024):
-                    tmp.write(chunk)
-                tmp.flush()
-
-                box_text = hf_ocr(tmp.name)
-                queue_supplier(url, caption, box_text)
-
-        except Exception as e:
-            logging.error("Processing %s failed: %s", url, e)
-
-    if max_id != last:
-        set_last_offset(max_id)
-        logging.info("Updated last_offset → %d", max_id)
+        # Graceful shutdown: everything already queued is processed first.
+        for _ in range(DOWNLOAD_WORKERS):
+            await downloads.put(DONE)
+        await stages
+        logging.info("Image cache: %s", cache.stats)
+        cache.close()
 
 if __name__ == "__main__":
-    handle_telegram()
+    asyncio.run(handle_telegram())
@@ -1,68 +1,213 @@
 import os
-from uuid import uuid4
-from rapidfuzz import fuzz
+import sys
+from collections import defaultdict
+from uuid import UUID, uuid5
 from supabase import create_client
 
+import numpy as np
+from rapidfuzz import fuzz
+
+# Run as a script: this directory is on sys.path, the repo root (embeddings,
+# storage, persian_text) is not.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from blocking import BlockingIndex, best_matches  # noqa: E402
+from catalog import CatalogSnapshot, iter_rows  # noqa: E402
+from vector_index import ProductVectorIndex  # noqa: E402
+from embeddings import get_embedding_service  # noqa: E402
+from persian_text import normalize  # noqa: E402
+
 # ─── Supabase setup ───────────────────────────────────────────────────────────
 URL = os.environ["SUPABASE_URL"]
 KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 sb  = create_client(URL, KEY)
 
+FULL_SYNC = os.getenv("MATCHER_FULL_SYNC", "0") == "1"
+SEMANTIC = os.getenv("MATCHER_SEMANTIC", "1") == "1"
+SEMANTIC_TOP_K = int(os.getenv("MATCHER_SEMANTIC_TOP_K", "10"))
+# Cosine similarity a semantic neighbour needs before it counts at all. The
+# model is English-only, so on Persian names unrelated strings often land
+# around 0.5; below this cutoff only the fuzzy score decides.
+SEMANTIC_THRESHOLD = float(os.getenv("MATCHER_SEMANTIC_THRESHOLD", "0.8"))
+BATCH_SIZE = int(os.getenv("MATCHER_BATCH_SIZE", "500"))
+# Fixed namespace for deterministic review ids (see review_id).
+REVIEW_NAMESPACE = UUID("6f1c2a9e-3b7d-4e58-9a0c-5d2e8b4f7a13")
+
 # ─── Fetch pending supplier offers ────────────────────────────────────────────
 def fetch_pending_offers():
-    res = sb.table("supplier_queue") \
-            .select("id, extracted_name, image_url, supplier") \
-            .eq("status", "pending") \
-            .execute()
-    return res.data or []
-
-# ─── Fetch your catalog ────────────────────────────────────────────────────────
-def fetch_products():
-    res = sb.table("products") \
-            .select("id, product_slug, name") \
-            .execute()
-    return res.data or []
+    return list(iter_rows(sb, "supplier_queue",
+                          "id, extracted_name, image_url, supplier",
+                          filters=lambda q: q.eq("status", "pending")))
 
 # ─── Insert review candidates ─────────────────────────────────────────────────
-def enqueue_review(offer_id, product_id, slug, name, score, supplier, image_url):
-    sb.table("review_queue").insert({
-        "id":           str(uuid4()),
+def review_id(offer_id, product_id):
+    # Idempotency key: replaying a crashed run produces the same id for the
+    # same offer/product pair, so the bulk upsert below skips it.
+    return str(uuid5(REVIEW_NAMESPACE, f"{offer_id}:{product_id}"))
+
+def review_row(offer_id, product_id, slug, name, score, supplier, image_url, semantic=0.0):
+    return {
+        "id":           review_id(offer_id, product_id),
         "product_id":   product_id,
         "candidate_name": name,
         "candidate_shop": supplier,
         "fuzzy_score":  score,
-        "semantic_score": 0,           # fill later if you add embeddings
+        "semantic_score": semantic,
         "raw_torob_data": {},          # optional
         "product_slug": slug,
         "status":      "pending",
         "queued_at":   "now()"
-    }).execute()
-    # mark original offer
+    }
+
+def commit_reviews(rows, offer_ids):
+    """One bulk insert into review_queue + one `in (...)` status update per batch."""
+    if not rows:
+        return
+    # Reviews first: if we die before the update, the offers stay pending and
+    # the next run re-inserts the same ids, which ignore_duplicates drops.
+    sb.table("review_queue") \
+      .upsert(rows, on_conflict="id", ignore_duplicates=True) \
+      .execute()
+    # mark original offers
     sb.table("supplier_queue").update({"status": "in_review"}) \
-      .eq("id", offer_id).execute()
+      .in_("id", offer_ids).execute()
+
+# ─── Scoring ──────────────────────────────────────────────────────────────────
+def semantic_matches(vectors, index, prods, offer_names, fuzzy):
+    """
+    Fuse each offer's fuzzy winner with its semantic top-k neighbours.
+
+    Every candidate is scored max(fuzzy, 100 × cosine), but the cosine only
+    takes part once it reaches SEMANTIC_THRESHOLD (the crawler's review
+    cutoff), so it can't push an otherwise unrelated product over
+    MATCH_THRESHOLD. Returns (row, final, fuzzy, cosine) per offer.
+    """
+    service = vectors.service
+    vectors.update(prods)   # already embedded: only selects the rows to search
+    queries = service.encode(offer_names)
+    service.save()
+
+    top_rows, top_sims = vectors.search(queries, k=SEMANTIC_TOP_K)
+    fused = []
+    for i, name in enumerate(offer_names):
+        cands = dict(zip(top_rows[i].tolist(), top_sims[i].tolist()))
+        if fuzzy[i] and fuzzy[i][0] not in cands:
+            row = fuzzy[i][0]
+            vec = vectors.vectors([row])[0]
+            norm = float(np.linalg.norm(queries[i])) or 1.0
+            cands[row] = float(vec @ queries[i]) / norm
+
+        query = normalize(name)
+        best = None
+        for row, sem in cands.items():
+            f = fuzzy[i][1] if fuzzy[i] and fuzzy[i][0] == row else fuzz.token_sort_ratio(query, index.normalized[row])
+            final = max(f, 100 * sem) if sem >= SEMANTIC_THRESHOLD else f
+            if best is None or final > best[1]:
+                best = (row, final, f, sem)
+        fused.append(best)
+    return fused
+
+def score_offers(offers, prods, vectors=None):
+    """Best (row in prods, final, fuzzy, cosine) per offer, or None."""
+    if not offers or not prods:
+        return [None] * len(offers)
+    # Block first (n-gram index → short candidate list per offer), then score
+    # all offers against their candidates in vectorised cdist chunks.
+    names = [o["extracted_name"] or "" for o in offers]
+    index = BlockingIndex([p["name"] or "" for p in prods])
+    fuzzy = best_matches(index, names)
+    if vectors is not None:
+        return semantic_matches(vectors, index, prods, names, fuzzy)
+    return [(m[0], m[1], m[1], 0.0) if m else None for m in fuzzy]
+
+def plan_incremental(offers, prods, states):
+    """
+    Split offers by how much of the catalog they still need to be scored
+    against. An offer whose stored best covers catalog version V only needs
+    products added or renamed after V (key V); offers never scored, renamed
+    since, or whose stored best product itself changed go to key None (full
+    catalog). Also returns the stored bests to start from.
+    """
+    pos = {p["id"]: i for i, p in enumerate(prods)}
+    groups, bests = defaultdict(list), {}
+    for o in offers:
+        st = states.get(o["id"])
+        if st and st["offer_name"] == normalize(o["extracted_name"] or ""):
+            row = pos.get(st["product_id"])
+            if st["product_id"] is None or (row is not None and prods[row]["name_version"] <= st["version"]):
+                if row is not None:
+                    bests[o["id"]] = (row, st["final"], st["fuzzy"], st["semantic"])
+                groups[st["version"]].append(o)
+                continue
+        groups[None].append(o)
+    return groups, bests
 
 # ─── Main matching logic ──────────────────────────────────────────────────────
+MATCH_THRESHOLD = 50   # tune threshold
+
 def main():
-    offers  = fetch_pending_offers()
-    prods   = fetch_products()
+    offers = fetch_pending_offers()
+    with CatalogSnapshot() as catalog:
+        # Local snapshot, topped up with the rows changed since the last run.
+        changed = catalog.sync(sb, full=FULL_SYNC)
+        prods   = catalog.products()
+        version = catalog.version
+        print(f"Catalog sync: {changed} changed products (version {version})")
+
+        vectors = None
+        service = get_embedding_service()
+        if SEMANTIC and service.available:
+            vectors = ProductVectorIndex(service)
+            print(f"Semantic index: {vectors.update(prods)} product names embedded")
+
+        # Only score what changed since each offer's stored best was computed.
+        groups, bests = plan_incremental(offers, prods, catalog.match_states())
+        scored = 0
+        for since, group in groups.items():
+            rows = [i for i, p in enumerate(prods) if since is None or p["name_version"] > since]
+            subset = [prods[i] for i in rows]
+            for o, m in zip(group, score_offers(group, subset, vectors)):
+                if m and (o["id"] not in bests or m[1] > bests[o["id"]][1]):
+                    bests[o["id"]] = (rows[m[0]], *m[1:])
+            scored += len(group) if subset else 0
+        print(f"Scored {scored} of {len(offers)} offers "
+              f"({len(groups.get(None, []))} against the full catalog)")
+
+        catalog.save_match_states({
+            o["id"]: {
+                "offer_name": normalize(o["extracted_name"] or ""),
+                "version":    version,
+                "product_id": prods[bests[o["id"]][0]]["id"] if o["id"] in bests else None,
+                "final":      bests[o["id"]][1] if o["id"] in bests else None,
+                "fuzzy":      bests[o["id"]][2] if o["id"] in bests else None,
+                "semantic":   bests[o["id"]][3] if o["id"] in bests else None,
+            }
+            for o in offers
+        })
+
+    matched = 0
+    rows, offer_ids = [], []
     for o in offers:
-        best = None
-        for p in prods:
-            score = fuzz.token_sort_ratio(o["extracted_name"], p["name"])
-            if not best or score > best[1]:
-                best = (p, score)
-        if best and best[1] >= 50:   # tune threshold
-            p, sc = best
-            enqueue_review(
+        best = bests.get(o["id"])
+        if best and best[1] >= MATCH_THRESHOLD:
+            row, _, sc, sem = best
+            p = prods[row]
+            rows.append(review_row(
                 offer_id=o["id"],
                 product_id=p["id"],
                 slug=p["product_slug"],
                 name=o["extracted_name"],
                 score=sc,
                 supplier=o["supplier"],
-                image_url=o["image_url"]
-            )
-    print(f"Matched {len(offers)} offers into review_queue.")
+                image_url=o["image_url"],
+                semantic=round(sem, 4)
+            ))
+            offer_ids.append(o["id"])
+            matched += 1
+            if len(rows) >= BATCH_SIZE:
+                commit_reviews(rows, offer_ids)
+                rows, offer_ids = [], []
+    commit_reviews(rows, offer_ids)
+    print(f"Matched {matched} of {len(offers)} offers into review_queue.")
 
 if __name__ == "__main__":
     main()
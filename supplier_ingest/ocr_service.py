@@ -0,0 +1,186 @@
+# supplier_ingest/ocr_service.py
+
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "1600"))
+DEFAULT_CAPTION_MODEL = os.getenv("OCR_CAPTION_MODEL", "Salesforce/blip-image-captioning-base")
+
+
+def preprocess(data: bytes, max_side: int = DEFAULT_MAX_SIDE, grayscale: bool = True) -> Image.Image:
+    """Decode, downscale so the longest side is at most `max_side`, optionally grayscale."""
+    img = Image.open(BytesIO(data))
+    img.draft("L" if grayscale else "RGB", (max_side, max_side))   # cheap JPEG pre-scale
+    img = img.convert("L" if grayscale else "RGB")
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    return img
+
+
+def _tesseract(data: bytes, lang: str, max_side: int) -> str:
+    # Runs in a worker process: decode + preprocess there too so only bytes
+    # cross the process boundary.
+    import pytesseract
+    return pytesseract.image_to_string(preprocess(data, max_side), lang=lang).strip()
+
+
+class TesseractBackend:
+    """Tesseract in a process pool, one image per task."""
+
+    name = "tesseract"
+
+    def __init__(self, workers: int | None = None, lang: str = "eng+fas", max_side: int = DEFAULT_MAX_SIDE):
+        self.lang = lang
+        self.max_side = max_side
+        self._pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+    async def run(self, images: list[bytes]) -> list[str]:
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(
+            loop.run_in_executor(self._pool, _tesseract, data, self.lang, self.max_side) for data in images
+        ))
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class CaptionBackend:
+    """
+    Local BLIP-style image-to-text model (transformers pipeline), one forward
+    pass per batch. Loaded on first use, on GPU when one is available.
+    """
+
+    name = "caption"
+
+    def __init__(self, model_name: str = DEFAULT_CAPTION_MODEL, max_side: int = DEFAULT_MAX_SIDE):
+        self.model_name = model_name
+        self.max_side = max_side
+        self._pipe = None
+
+    def _load(self):
+        if self._pipe is None:
+            import torch
+            from transformers import pipeline
+            device = 0 if torch.cuda.is_available() else -1
+            logging.info("Loading caption model %s (device=%s)", self.model_name, device)
+            self._pipe = pipeline("image-to-text", model=self.model_name, device=device)
+        return self._pipe
+
+    def _caption(self, images: list[bytes]) -> list[str]:
+        pipe = self._load()
+        pil = [preprocess(data, self.max_side, grayscale=False) for data in images]
+        out = pipe(pil, batch_size=len(pil))
+        return [(r[0] if isinstance(r, list) else r).get("generated_text", "").strip() for r in out]
+
+    async def run(self, images: list[bytes]) -> list[str]:
+        return await asyncio.to_thread(self._caption, images)
+
+    def close(self):
+        self._pipe = None
+
+
+class OCRService:
+    """
+    Async front door to an OCR backend.
+
+    Handlers `await service.ocr(data)` and get the text, or None if the
+    backend failed (so callers can avoid caching the failure); requests are collected into batches of
+    up to `batch_size` (waiting at most `max_wait` seconds for a batch to
+    fill) and `concurrency` batches run at once, so the event loop never
+    blocks on OCR. Per-image latency (submit → text) goes to `timings`;
+    `summary()` reports counts and p50/p95/max.
+
+        service = make_service()          # or OCRService(TesseractBackend(4), concurrency=4)
+        text = await service.ocr(image_bytes)
+    """
+
+    def __init__(self, backend, concurrency: int = 2, batch_size: int = 8, max_wait: float = 0.05):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.stats = {"images": 0, "batches": 0, "errors": 0}
+        self.timings: list[float] = []
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+
+    def _start(self):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def ocr(self, data: bytes) -> str | None:
+        if self._queue is None:
+            self._start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((data, fut, time.perf_counter()))
+        return await fut
+
+    async def _next_batch(self) -> list[tuple]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                texts = await self.backend.run([data for data, _, _ in batch])
+            except Exception as e:
+                logging.warning("%s OCR batch of %d failed: %s", self.backend.name, len(batch), e)
+                self.stats["errors"] += len(batch)
+                texts = [None] * len(batch)
+            self.stats["batches"] += 1
+            now = time.perf_counter()
+            for (_, fut, submitted), text in zip(batch, texts):
+                self.stats["images"] += 1
+                self.timings.append(now - submitted)
+                logging.debug("%s OCR took %.3fs", self.backend.name, now - submitted)
+                if not fut.done():
+                    fut.set_result(text)
+
+    def summary(self) -> dict:
+        t = np.asarray(self.timings) if self.timings else np.zeros(1)
+        return {
+            **self.stats,
+            "backend": self.backend.name,
+            "p50_s": round(float(np.percentile(t, 50)), 3),
+            "p95_s": round(float(np.percentile(t, 95)), 3),
+            "max_s": round(float(t.max()), 3),
+        }
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers, self._queue = [], None
+        self.backend.close()
+
+
+def make_service(name: str | None = None) -> OCRService:
+    """
+    OCRService configured from the environment (OCR_BACKEND, OCR_CONCURRENCY,
+    OCR_BATCH_SIZE). Tesseract gets one image per task and a process per
+    concurrent task; the caption model batches images into one forward pass.
+    """
+    name = name or os.getenv("OCR_BACKEND", "tesseract")
+    concurrency = int(os.getenv("OCR_CONCURRENCY", "0"))
+    if name == "caption":
+        return OCRService(CaptionBackend(), concurrency=concurrency or 1,
+                          batch_size=int(os.getenv("OCR_BATCH_SIZE", "8")))
+    workers = concurrency or os.cpu_count() or 1
+    return OCRService(TesseractBackend(workers), concurrency=workers, batch_size=1)
@@ -7,23 +7,28 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
-import tempfile, logging
+import os, sys, logging, asyncio
 from uuid import uuid4
-from PIL import Image
-import pytesseract
 from supabase import create_client
 
+# Run as a script: this directory is on sys.path, the repo root (storage,
+# persian_text) is not.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_dedupe import ImageFingerprintCache, dhash  # noqa: E402
+from persian_text import clean  # noqa: E402
+from ocr_service import make_service  # noqa: E402
+
 # Supabase client
 sb = create_client(
     os.environ["SUPABASE_URL"],
     os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 )
 
-def ocr_image(path):
-    return pytesseract.image_to_string(Image.open(path), lang="eng+fas").strip()
-
-def normalize(text):
-    return " ".join(text.split())
+# OCR results per photo, shared by every handler of this process
+image_cache = ImageFingerprintCache()
+# Handlers submit images here; OCR runs in a process pool / batched model,
+# never on the event loop (OCR_BACKEND=tesseract|caption).
+ocr_service = make_service()
 
 def queue_supplier(image_url, raw_text, name, supplier):
     sb.table("supplier_queue").insert({
@@ -48,23 +53,47 @@ async def on_photo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     photo = msg.photo[-1]
     f = await ctx.bot.get_file(photo.file_id)
-    with tempfile.NamedTemporaryFile(suffix=".jpg") as tmp:
-        await f.download_to_drive(tmp.name)
-        raw = ocr_image(tmp.name)
+    # Same file or a near-identical picture → reuse its OCR text.
+    hit = image_cache.find(photo.file_unique_id)
+    if hit is None:
+        data = bytes(await f.download_as_bytearray())
+        phash = await asyncio.to_thread(dhash, data)
+        hit = image_cache.find_similar(phash)
+        ocr_failed = False
+        if hit is None:
+            ocr_text = await ocr_service.ocr(data)
+            ocr_failed = ocr_text is None
+            hit = (phash, ocr_text or "")
+        # A failed OCR isn't remembered, so the next copy gets another try.
+        if not ocr_failed:
+            image_cache.add(photo.file_unique_id, *hit)
+    phash, raw = hit
 
-    combined = normalize(f"{text} {raw}")
-    queue_supplier(f.file_path, combined, combined, supplier)
+    combined = clean(f"{text} {raw}")
+    if not image_cache.mark_queued(phash, supplier, combined):
+        await update.message.reply_text(f"ℹ️ Already queued “{combined}”")
+        return
+    try:
+        queue_supplier(f.file_path, combined, combined, supplier)
+    except Exception:
+        # Not on supplier_queue after all: let a re-forward queue it.
+        image_cache.unmark_queued(phash, supplier, combined)
+        raise
 
     # Optional: acknowledge to the supplier
     await update.message.reply_text(f"✅ Received and queued “{combined}”")
 
+async def on_shutdown(app):
+    logging.info("OCR stats: %s", ocr_service.summary())
+    await ocr_service.close()
+
 async def main():
     logging.basicConfig(level=logging.INFO)
-    app = ApplicationBuilder().token(os.environ["TELEGRAM_BOT_TOKEN"]).build()
+    app = ApplicationBuilder().token(os.environ["TELEGRAM_BOT_TOKEN"]) \
+        .post_shutdown(on_shutdown).build()
     app.add_handler(MessageHandler(filters.PHOTO, on_photo))
     logging.info("Starting bot, waiting for forwarded supplier images…")
     await app.run_polling()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,139 @@
+# supplier_ingest/vector_index.py
+
+import json
+import os
+
+import numpy as np
+
+from embeddings import EmbeddingService, text_key
+from storage import data_path
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+class ProductVectorIndex:
+    """
+    Persistent, memory-mapped matrix of unit-length product-name embeddings.
+
+    Rows are stored in an .npy file opened with `mmap_mode`, so a run only pages
+    in what it touches; a JSON sidecar maps product id → (row, name key).
+    `update()` re-encodes only products that are new or were renamed since the
+    last run, and `search()` does top-k cosine search for a batch of queries,
+    reading the catalog a block of rows at a time and merging each block's
+    top-k into a running one.
+
+        vectors = ProductVectorIndex(service)
+        vectors.update(products)
+        rows, sims = vectors.search(service.encode(offer_names), k=10)
+    """
+
+    def __init__(self, service: EmbeddingService, path: str | None = None):
+        self.service = service
+        safe_name = service.model_name.replace("/", "__")
+        self.path = path or data_path("product_vectors", f"{safe_name}.npy")
+        self.meta_path = self.path[:-len(".npy")] + ".json"
+        self._rows: dict[str, list] = {}   # str(product id) → [row, name key]
+        self._matrix: np.ndarray | None = None
+        self._active = np.zeros(0, dtype=np.intp)   # rows of the current catalog, in update() order
+        self._load()
+
+    def _load(self):
+        if not (os.path.exists(self.path) and os.path.exists(self.meta_path)):
+            return
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                self._rows = json.load(f)
+            self._matrix = np.load(self.path, mmap_mode="r+")
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable product vectors {self.path}: {e}")
+            self._rows, self._matrix = {}, None
+
+    def _save_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._rows, f)
+        os.replace(tmp, self.meta_path)
+
+    def _grow(self, extra: int, dim: int):
+        """Re-create the .npy with room for `extra` more rows, streaming the old ones across."""
+        old = self._matrix
+        size = 0 if old is None else len(old)
+        tmp = self.path + ".tmp.npy"
+        new = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(size + extra, dim))
+        for start in range(0, size, 65536):
+            end = min(start + 65536, size)
+            new[start:end] = old[start:end]
+        new.flush()
+        del new, old
+        self._matrix = None   # drop the last reference to the old mapping
+        os.replace(tmp, self.path)
+        self._matrix = np.load(self.path, mmap_mode="r+")
+        return size
+
+    def update(self, products: list[dict]) -> int:
+        """
+        Sync the matrix with the catalog (rows aligned with `products` order for
+        `search`); returns how many names had to be (re-)embedded.
+        """
+        stale = []
+        for p in products:
+            entry = self._rows.get(str(p["id"]))
+            if entry is None or entry[1] != text_key(p["name"] or ""):
+                stale.append(p)
+
+        if stale:
+            fresh = _normalize_rows(self.service.encode([p["name"] or "" for p in stale]))
+            appended = [p for p in stale if str(p["id"]) not in self._rows]
+            next_row = self._grow(len(appended), fresh.shape[1]) if appended else len(self._matrix)
+            for p, vec in zip(stale, fresh):
+                pid = str(p["id"])
+                if pid not in self._rows:
+                    self._rows[pid] = [next_row, None]
+                    next_row += 1
+                self._matrix[self._rows[pid][0]] = vec
+                self._rows[pid][1] = text_key(p["name"] or "")
+            self._matrix.flush()
+            self._save_meta()
+
+        self._active = np.fromiter((self._rows[str(p["id"])][0] for p in products),
+                                   dtype=np.intp, count=len(products))
+        return len(stale)
+
+    def vectors(self, positions) -> np.ndarray:
+        """Stored vectors for positions in the product list passed to `update()`."""
+        return np.asarray(self._matrix[self._active[positions]], dtype=np.float32)
+
+    def search(self, queries: np.ndarray, k: int = 10, chunk_size: int = 256,
+               block_rows: int = 16384) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k cosine search of every query row against the catalog passed to
+        the last `update()`. Returns (positions into that product list, sims),
+        both shaped (len(queries), k) and sorted best first. At most
+        `block_rows` catalog rows are copied out of the mapping at a time.
+        """
+        n = len(self._active)
+        k = min(k, n)
+        if k == 0 or len(queries) == 0:
+            return np.zeros((len(queries), 0), dtype=np.intp), np.zeros((len(queries), 0), dtype=np.float32)
+
+        queries = _normalize_rows(np.asarray(queries, dtype=np.float32))
+        top_pos = np.zeros((len(queries), k), dtype=np.intp)
+        top_sim = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for first in range(0, n, block_rows):
+            block = np.asarray(self._matrix[self._active[first:first + block_rows]], dtype=np.float32)
+            kk = min(k, len(block))
+            for start in range(0, len(queries), chunk_size):
+                q = slice(start, start + chunk_size)
+                sims = queries[q] @ block.T
+                part = np.argpartition(-sims, kk - 1, axis=1)[:, :kk]
+                cand_sim = np.concatenate([top_sim[q], np.take_along_axis(sims, part, axis=1)], axis=1)
+                cand_pos = np.concatenate([top_pos[q], part + first], axis=1)
+                keep = np.argpartition(-cand_sim, k - 1, axis=1)[:, :k]
+                top_sim[q] = np.take_along_axis(cand_sim, keep, axis=1)
+                top_pos[q] = np.take_along_axis(cand_pos, keep, axis=1)
+
+        order = np.argsort(-top_sim, axis=1)
+        return np.take_along_axis(top_pos, order, axis=1), np.take_along_axis(top_sim, order, axis=1)
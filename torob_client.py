@@ -0,0 +1,250 @@
+# torob_client.py
+
+import asyncio
+import json
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from storage import data_path
+
+TOROB_SEARCH_URL = "https://api.torob.com/v4/base-product/search/"
+TOROB_PAGE_SIZE = 24
+DEFAULT_CACHE_TTL = 3 * 60 * 60   # one cron window
+
+
+def normalize_query(q: str) -> str:
+    return " ".join(q.lower().split())
+
+
+async def single_flight(inflight: dict, key: str, fn):
+    """Run `fn()` once per key at a time; concurrent callers await the same result."""
+    while key in inflight:
+        shared = inflight[key]
+        try:
+            return await asyncio.shield(shared)
+        except asyncio.CancelledError:
+            if not shared.cancelled():
+                raise
+            # The caller that owned the request was cancelled (e.g. a page
+            # prefetch nobody needs any more): take it over instead.
+
+    future = asyncio.get_running_loop().create_future()
+    inflight[key] = future
+    try:
+        result = await fn()
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()   # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        del inflight[key]
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ResponseCache:
+    """
+    TTL cache of JSON-serializable Torob responses: an in-memory dict in front
+    of a small SQLite table, so repeats within a run and across cron runs skip
+    the network.
+
+    The unexpired rows are read once up front and new responses are written
+    back in batches of `flush_every` (and on close), so lookups and stores
+    from the event loop never wait on a per-response commit.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_CACHE_TTL, path: str | None = None, flush_every: int = 256):
+        self.ttl = ttl
+        self.flush_every = flush_every
+        self._pending: list[tuple[str, float, str]] = []
+        self._db = sqlite3.connect(path or data_path("torob_cache.db"))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, fetched_at REAL, body TEXT)"
+        )
+        self._db.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - ttl,))
+        self._db.commit()
+        self._memory: dict[str, tuple[float, object]] = {
+            key: (fetched_at, json.loads(body))
+            for key, fetched_at, body in self._db.execute("SELECT key, fetched_at, body FROM responses")
+        }
+
+    def get(self, key: str):
+        hit = self._memory.get(key)
+        if hit is None:
+            return None
+        fetched_at, body = hit
+        if time.time() - fetched_at > self.ttl:
+            self._memory.pop(key, None)
+            return None
+        return body
+
+    def put(self, key: str, body):
+        now = time.time()
+        self._memory[key] = (now, body)
+        self._pending.append((key, now, json.dumps(body, ensure_ascii=False)))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO responses (key, fetched_at, body) VALUES (?, ?, ?)", self._pending
+            )
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+class AsyncTorobClient:
+    """
+    Async drop-in for `torob_integration.api.Torob.search`.
+
+    Requests share one pooled aiohttp session, are throttled by a per-host token
+    bucket, and are answered from a TTL cache keyed by (normalized query, page).
+    Concurrent identical searches share a single in-flight request.
+
+        async with AsyncTorobClient() as torob:
+            resp = await torob.search(q="...", page=0)
+    """
+
+    def __init__(self, rate: float = 2.0, burst: int = 4, cache_ttl: float = DEFAULT_CACHE_TTL,
+                 max_connections: int = 8, max_retries: int = 3, timeout: float = 20.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = ResponseCache(cache_ttl)
+        self.stats = {"requests": 0, "cache_hits": 0, "pages": 0, "prefetch_cancelled": 0}
+        self._buckets: dict[str, TokenBucket] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"},
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.cache.close()
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return self._buckets[host]
+
+    async def search(self, q: str, page: int = 0) -> dict:
+        key = f"{normalize_query(q)}|{page}"
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+
+        if key in self._inflight:
+            self.stats["cache_hits"] += 1
+
+        async def fetch():
+            body = await self._fetch(q, page)
+            self.cache.put(key, body)
+            return body
+
+        return await single_flight(self._inflight, key, fetch)
+
+    async def iter_pages(self, q: str, max_pages: int = 3):
+        """
+        Yield the result list of each search page in turn, up to `max_pages`.
+
+        The next page is requested in the background as soon as the current one
+        is handed out, so it downloads while the caller scores. A short page
+        ends the stream; a caller that has seen enough simply stops iterating
+        (wrap in `contextlib.aclosing`) and the pending prefetch is cancelled.
+
+            async with aclosing(torob.iter_pages(name)) as pages:
+                async for results in pages:
+                    ...
+                    if good_enough:
+                        break
+        """
+        pending = asyncio.create_task(self.search(q, 0))
+        try:
+            for page in range(max_pages):
+                results = (await pending).get("results", [])
+                pending = None
+                self.stats["pages"] += 1
+                if page + 1 < max_pages and len(results) >= TOROB_PAGE_SIZE:
+                    pending = asyncio.create_task(self.search(q, page + 1))
+                if results:
+                    yield results
+                if pending is None:
+                    return
+        finally:
+            if pending is not None:
+                if not pending.done():
+                    self.stats["prefetch_cancelled"] += 1
+                    pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
+
+    async def _fetch(self, q: str, page: int) -> dict:
+        await self.start()
+        params = {"q": q, "query": q, "page": page, "size": TOROB_PAGE_SIZE, "sort": "popularity", "source": "next_desktop"}
+        for attempt in range(1, self.max_retries + 1):
+            await self._bucket(TOROB_SEARCH_URL).acquire()
+            self.stats["requests"] += 1
+            try:
+                async with self._session.get(TOROB_SEARCH_URL, params=params) as resp:
+                    if resp.status in (429, 503) and attempt < self.max_retries:
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+                    resp.raise_for_status()
+                    return await resp.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+        raise RuntimeError(f"Torob search for {q!r} exhausted {self.max_retries} retries")
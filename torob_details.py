@@ -0,0 +1,68 @@
+# torob_details.py
+
+import asyncio
+
+from crawl4ai.async_crawler_strategy import AsyncHTTPCrawlerStrategy
+
+from page_extraction import ParsedPage
+from storage import data_path
+from torob_client import DEFAULT_CACHE_TTL, ResponseCache, single_flight
+
+TOROB_BASE_URL = "https://torob.com"
+
+
+def parse_shop_names(html: str, limit: int = 3) -> list[str]:
+    """Return up to `limit` unique seller names from a Torob product detail page."""
+    return ParsedPage(html).torob_shops(limit)
+
+
+class SellerDetailResolver:
+    """
+    Resolves the seller list behind a Torob "فروشگاه" result.
+
+    Detail pages are static, so they're fetched with the plain HTTP strategy
+    rather than a Playwright page. Parsed seller lists are cached with a TTL
+    (in memory and in SQLite) and concurrent lookups of the same URL share one
+    request, so sibling products pointing at the same page cost one fetch.
+
+        async with SellerDetailResolver() as details:
+            shops = await details.shops("/p/...")
+    """
+
+    def __init__(self, cache_ttl: float = DEFAULT_CACHE_TTL, max_shops: int = 3):
+        self.max_shops = max_shops
+        self.cache = ResponseCache(cache_ttl, path=data_path("torob_details.db"))
+        self.stats = {"fetches": 0, "cache_hits": 0}
+        self._http = AsyncHTTPCrawlerStrategy()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def __aenter__(self):
+        await self._http.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._http.close()
+        self.cache.close()
+
+    async def shops(self, link_path: str) -> list[str]:
+        url = link_path if link_path.startswith("http") else TOROB_BASE_URL + link_path
+        cached = self.cache.get(url)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+
+        if url in self._inflight:
+            self.stats["cache_hits"] += 1
+
+        async def fetch():
+            self.stats["fetches"] += 1
+            try:
+                resp = await self._http.crawl(url)
+            except Exception as e:
+                print(f"[ERROR] Unable to fetch {url}: {e}")
+                return []
+            shops = await asyncio.to_thread(parse_shop_names, resp.html, self.max_shops)
+            self.cache.put(url, shops)
+            return shops
+
+        return await single_flight(self._inflight, url, fetch)